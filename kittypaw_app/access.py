@@ -0,0 +1,95 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import Device, Pet, PetOwner
+
+# Cambia con cada alta, baja o modificación de Pet/PetOwner (ver signals.py);
+# forma parte de la clave, así que invalida de una vez el acceso de todos los
+# usuarios, incluido el dueño anterior cuando una mascota cambia de dueño.
+# QuerySet.update(), bulk_create y bulk_update no emiten esas señales: quien
+# modifique Pet/PetOwner en bloque debe llamar a invalidate_access(), o el
+# acceso anterior se sigue sirviendo hasta ACCESS_CACHE_TIMEOUT
+GENERATION_KEY = 'access:generation'
+
+
+def is_admin(user):
+    return getattr(user, 'role', None) == 'admin'
+
+
+def invalidate_access():
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = time.time_ns()
+        cache.add(GENERATION_KEY, generation, None)
+        generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def user_access(user):
+    """
+    Propietario, mascotas y collares visibles para un usuario no
+    administrador, leídos de la caché o con dos consultas:
+    {'owner': pk o None, 'pets': frozenset, 'devices': frozenset}
+    """
+    key = f"access:{_generation()}:{user.pk}"
+    access = cache.get(key)
+    if access is None:
+        owner_id = PetOwner.objects.filter(username=user.username).values_list('pk', flat=True).first()
+        pets = Pet.objects.filter(owner_id=owner_id).values_list('pk', 'kitty_paw_device_id') if owner_id else []
+        access = {
+            'owner': owner_id,
+            'pets': frozenset(pk for pk, _ in pets),
+            'devices': frozenset(device_id for _, device_id in pets if device_id),
+        }
+        cache.set(key, access, getattr(settings, 'ACCESS_CACHE_TIMEOUT', 300))
+    return access
+
+
+def owner_id_for_user(user):
+    """
+    pk del propietario asociado al usuario (mismo username), o None
+    """
+    if not user.is_authenticated:
+        return None
+    return user_access(user)['owner']
+
+
+def accessible_device_ids(user):
+    """
+    device_id de los collares que el usuario puede ver; None significa todos
+    (administradores)
+    """
+    if is_admin(user):
+        return None
+    if not user.is_authenticated:
+        return frozenset()
+    return user_access(user)['devices']
+
+
+def accessible_pet_ids(user):
+    if is_admin(user):
+        return None
+    if not user.is_authenticated:
+        return frozenset()
+    return user_access(user)['pets']
+
+
+def can_access_device(user, device_id):
+    device_ids = accessible_device_ids(user)
+    return device_ids is None or device_id in device_ids
+
+
+def can_access_pet(user, pet_id):
+    pet_ids = accessible_pet_ids(user)
+    return pet_ids is None or pet_id in pet_ids
+
+
+def accessible_devices(user):
+    device_ids = accessible_device_ids(user)
+    if device_ids is None:
+        return Device.objects.all()
+    return Device.objects.filter(device_id__in=device_ids)
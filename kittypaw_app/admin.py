@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Device, SensorData, MqttConnection, PetOwner, Pet
+from .models import User, Device, SensorData, LatestSensorReading, MqttConnection, MqttTopic, PetOwner, Pet
 
 # Configuración del panel de administración
 admin.site.site_header = 'KittyPawSensors Admin'
@@ -25,12 +25,23 @@ class SensorDataAdmin(admin.ModelAdmin):
     list_filter = ('sensor_type', 'timestamp')
     date_hierarchy = 'timestamp'
 
+@admin.register(LatestSensorReading)
+class LatestSensorReadingAdmin(admin.ModelAdmin):
+    list_display = ('device', 'sensor_type', 'value', 'unit', 'timestamp')
+    search_fields = ('device__device_id', 'device__name')
+    list_filter = ('sensor_type',)
+
 @admin.register(MqttConnection)
 class MqttConnectionAdmin(admin.ModelAdmin):
     list_display = ('broker_url', 'client_id', 'connected', 'last_connected')
     search_fields = ('broker_url', 'client_id')
     list_filter = ('connected',)
 
+@admin.register(MqttTopic)
+class MqttTopicAdmin(admin.ModelAdmin):
+    list_display = ('topic', 'qos', 'created_at')
+    search_fields = ('topic',)
+
 @admin.register(PetOwner)
 class PetOwnerAdmin(admin.ModelAdmin):
     list_display = ('name', 'paternal_last_name', 'email', 'username')
@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Func, Value, DateTimeField, DurationField, Sum, Min, Max, Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import SensorData, SensorRollupMinute, SensorRollupHour, SensorRollupDay, RollupWatermark
+
+# Tamaños de bucket admitidos por la API de historial
+BUCKETS = {
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+}
+
+AGGREGATES = ['avg', 'min', 'max', 'count']
+
+# Límite de puntos por serie para que la respuesta quede acotada
+MAX_BUCKETS = 5000
+
+# Origen fijo para que los buckets sean estables entre consultas
+BUCKET_ORIGIN = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+# Tablas de rollup, de la granularidad más gruesa a la más fina
+ROLLUPS = [
+    (timedelta(days=1), SensorRollupDay),
+    (timedelta(hours=1), SensorRollupHour),
+    (timedelta(minutes=1), SensorRollupMinute),
+]
+
+ROLLUP_WATERMARK = 'sensor_rollups'
+
+
+class DateBin(Func):
+    """
+    date_bin(intervalo, timestamp, origen) de PostgreSQL 14+
+    """
+    function = 'date_bin'
+    output_field = DateTimeField()
+
+    def __init__(self, interval, expression, origin=BUCKET_ORIGIN, **extra):
+        super().__init__(
+            Value(interval, output_field=DurationField()),
+            expression,
+            Value(origin, output_field=DateTimeField()),
+            **extra
+        )
+
+
+def select_rollup(interval):
+    """
+    Devuelve el rollup más grueso cuya granularidad divide exactamente el bucket
+    """
+    for granularity, model in ROLLUPS:
+        if interval % granularity == timedelta(0):
+            return model
+    return None
+
+
+def align(value, interval, up=False):
+    """
+    Alinea un instante al borde de bucket, igual que date_bin con BUCKET_ORIGIN
+    """
+    offset = (value - BUCKET_ORIGIN) % interval
+    if not offset:
+        return value
+    return value - offset + interval if up else value - offset
+
+
+def parse_timestamp(raw):
+    """
+    Convierte un parámetro ISO 8601 en datetime con zona horaria
+    """
+    value = parse_datetime(raw)
+    if value is None:
+        raise ValueError(f"Fecha inválida: {raw}")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def parse_time_range(params, default_span=timedelta(days=1)):
+    """
+    Lee `from` y `to` de los parámetros de consulta. Sin `to` se usa el
+    momento actual; sin `from` se usa `to - default_span`.
+    """
+    end = parse_timestamp(params['to']) if params.get('to') else timezone.now()
+    start = parse_timestamp(params['from']) if params.get('from') else end - default_span
+    if start >= end:
+        raise ValueError("'from' debe ser anterior a 'to'")
+    return start, end
+
+
+def parse_aggregates(raw):
+    if not raw:
+        return list(AGGREGATES)
+    aggregates = [name.strip() for name in raw.split(',') if name.strip()]
+    invalid = [name for name in aggregates if name not in AGGREGATES]
+    if invalid or not aggregates:
+        raise ValueError(f"Agregación no soportada: {', '.join(invalid)}. Opciones: {', '.join(AGGREGATES)}")
+    return aggregates
+
+
+def bucketed_series(device, sensor_type, bucket, aggregates, start, end):
+    """
+    Agrupa las lecturas en buckets de tiempo calculados en la base de datos y
+    devuelve, por tipo de sensor, arreglos columnares:
+    {'temperature': {'t': [...], 'avg': [...], 'min': [...], ...}}
+
+    Los buckets ya consolidados se leen del rollup más grueso que sirve para
+    el tamaño pedido; solo las lecturas posteriores al watermark se agregan
+    desde SensorData.
+    """
+    interval = BUCKETS[bucket]
+    start = align(start, interval)
+    end = align(end, interval, up=True)
+    if (end - start) / interval > MAX_BUCKETS:
+        raise ValueError(f"El rango solicitado supera {MAX_BUCKETS} buckets de {bucket}; use un bucket mayor")
+
+    filters = {'device': device}
+    if sensor_type:
+        filters['sensor_type'] = sensor_type
+
+    rollup = select_rollup(interval)
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost:
+            # Rollups y watermark deben verse en la misma instantánea
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+        watermark_id = 0
+        rows = []
+        if rollup is not None:
+            watermark_id = RollupWatermark.objects.filter(name=ROLLUP_WATERMARK).values_list('last_id', flat=True).first() or 0
+            rows.extend(
+                rollup.objects
+                .filter(bucket__gte=start, bucket__lt=end, **filters)
+                .annotate(b=DateBin(interval, 'bucket'))
+                .values('sensor_type', 'b')
+                .annotate(n=Sum('sample_count'), total=Sum('value_sum'), low=Min('value_min'), high=Max('value_max'))
+                .order_by()
+            )
+
+        rows.extend(
+            SensorData.objects
+            .filter(timestamp__gte=start, timestamp__lt=end, value__isnull=False, id__gt=watermark_id, **filters)
+            .annotate(b=DateBin(interval, 'timestamp'))
+            .values('sensor_type', 'b')
+            .annotate(n=Count('value'), total=Sum('value'), low=Min('value'), high=Max('value'))
+            .order_by()
+        )
+
+    # Combinar rollups y cola reciente: [conteo, suma, mínimo, máximo]
+    merged = {}
+    for row in rows:
+        key = (row['sensor_type'], row['b'])
+        acc = merged.get(key)
+        if acc is None:
+            merged[key] = [row['n'], row['total'], row['low'], row['high']]
+        else:
+            acc[0] += row['n']
+            acc[1] += row['total']
+            acc[2] = min(acc[2], row['low'])
+            acc[3] = max(acc[3], row['high'])
+
+    series = {}
+    for (sensor_type, bucket_start), (count, total, low, high) in sorted(merged.items()):
+        columns = series.get(sensor_type)
+        if columns is None:
+            columns = series[sensor_type] = {'t': [], **{name: [] for name in aggregates}}
+        columns['t'].append(bucket_start.isoformat())
+        values = {
+            'avg': total / count if count else None,
+            'min': low,
+            'max': high,
+            'count': count,
+        }
+        for name in aggregates:
+            columns[name].append(values[name])
+    return series
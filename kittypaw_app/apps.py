@@ -1,5 +1,8 @@
 from django.apps import AppConfig
+from django.conf import settings
 import logging
+import os
+import sys
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +14,20 @@ class KittypawAppConfig(AppConfig):
         """
         Inicializa componentes de la aplicación al arrancar
         """
-        try:
-            # Importar el cliente MQTT e inicializar la conexión
-            from .mqtt_client import mqtt_client
-            mqtt_client.load_and_connect()
-            logger.info("Cliente MQTT inicializado")
-        except Exception as e:
-            logger.error(f"Error inicializando cliente MQTT: {str(e)}")
\ No newline at end of file
+        # Registrar las señales que invalidan la caché de dispositivos
+        from . import signals  # noqa: F401
+        
+        # `manage.py runserver` sirve WSGI y no pasa por MqttEngineMiddleware;
+        # con el autoreloader el servidor corre en el proceso hijo (RUN_MAIN)
+        if sys.argv[1:2] == ['runserver'] and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv):
+            engine = getattr(settings, 'MQTT_ENGINE', 'external')
+            if engine != 'thread':
+                if engine != 'external':
+                    logger.warning("runserver solo inicia el motor MQTT 'thread'; use run_ingest para la ingesta")
+                return
+            try:
+                from .mqtt_client import mqtt_client
+                mqtt_client.load_and_connect()
+                logger.info("Cliente MQTT inicializado")
+            except Exception as e:
+                logger.error(f"Error inicializando cliente MQTT: {str(e)}")
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from channels.layers import InMemoryChannelLayer
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer que limpia mensajes y grupos vencidos como mucho una
+    vez por `cleanup_interval` segundos. La clase original recorre todos los
+    canales en cada receive y group_send, lo que vuelve cuadrático el costo
+    de una difusión en el número de clientes conectados.
+    """
+    cleanup_interval = 1.0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._next_cleanup = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + self.cleanup_interval
+        super()._clean_expired()
+
+
+class PostgresChannelLayer(LocalChannelLayer):
+    """
+    Channel layer entre procesos sobre LISTEN/NOTIFY de PostgreSQL, para
+    desplegar varios workers Daphne sin Redis.
+
+    Cada proceso mantiene sus grupos y canales en memoria como
+    LocalChannelLayer; `group_send` publica el mensaje con NOTIFY y cada
+    proceso que escucha lo entrega a sus miembros locales del grupo. `send`
+    a un canal concreto sigue siendo local al proceso.
+
+    Los mensajes que superan el límite de NOTIFY se guardan en
+    ChannelLayerMessage y se notifica solo su id; cada proceso los lee de la
+    tabla y las filas se borran pasados `overflow_ttl` segundos.
+
+    La escucha se registra en el event loop del servidor (add_reader sobre el
+    socket de la conexión) la primera vez que un consumidor se une a un grupo.
+    Si la conexión LISTEN se pierde se vuelve a abrir enseguida, con reintentos
+    cada vez más espaciados; las notificaciones emitidas mientras tanto se
+    pierden.
+    Requiere una conexión directa: los poolers en modo transacción (p. ej. el
+    endpoint "-pooler" de Neon) no admiten LISTEN.
+    """
+
+    # Límite de NOTIFY en PostgreSQL: 8000 bytes de carga útil
+    MAX_PAYLOAD = 7900
+    # Espera máxima (segundos) entre intentos de reabrir la conexión LISTEN
+    RECONNECT_MAX_DELAY = 30
+
+    def __init__(self, channel='kittypaw_channels', database='default', overflow_ttl=60, **kwargs):
+        super().__init__(**kwargs)
+        from .models import ChannelLayerMessage
+        self.notify_channel = channel
+        self.database = database
+        self.overflow_table = ChannelLayerMessage._meta.db_table
+        self.overflow_ttl = overflow_ttl
+        self._listen_conn = None
+        self._listen_loop = None
+        self._listen_task = None
+        self._send_conn = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        params = connections[self.database].get_connection_params()
+        params.pop('cursor_factory', None)
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _open_listen_conn(self):
+        """
+        Abre la conexión LISTEN; bloqueante, se ejecuta fuera del event loop
+        """
+        conn = self._connect()
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.notify_channel}"')
+        return conn
+
+    async def _ensure_listening(self):
+        loop = asyncio.get_running_loop()
+        if self._listen_conn is not None and self._listen_loop is loop and not self._listen_conn.closed:
+            return
+        # Las llamadas simultáneas esperan una única apertura en curso
+        task = self._listen_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = self._listen_task = loop.create_task(self._listen(retry=False))
+        await asyncio.shield(task)
+
+    async def _listen(self, retry):
+        loop = asyncio.get_running_loop()
+        delay = 1
+        while True:
+            try:
+                conn = await loop.run_in_executor(None, self._open_listen_conn)
+                break
+            except psycopg2.Error as e:
+                if not retry:
+                    raise
+                logger.error(f"No se pudo reabrir LISTEN en '{self.notify_channel}': {str(e)}; reintento en {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+        loop.add_reader(conn.fileno(), self._on_notify)
+        self._listen_conn = conn
+        self._listen_loop = loop
+        logger.info(f"Channel layer escuchando NOTIFY en '{self.notify_channel}'")
+
+    def _on_notify(self):
+        conn = self._listen_conn
+        try:
+            conn.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Conexión LISTEN del channel layer perdida: {str(e)}")
+            self._listen_loop.remove_reader(conn.fileno())
+            conn.close()
+            self._listen_conn = None
+            # Los grupos y canales locales siguen activos: volver a escuchar
+            # sin esperar al próximo receive o group_add
+            self._listen_task = self._listen_loop.create_task(self._listen(retry=True))
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                envelope = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self._listen_loop.create_task(self._deliver(envelope))
+
+    async def _deliver(self, envelope):
+        if 'id' in envelope:
+            # Mensaje grande: el cuerpo está en la tabla de desbordamiento
+            stored = await asyncio.get_running_loop().run_in_executor(None, self._load, envelope['id'])
+            if stored is None:
+                logger.error(f"Mensaje {envelope['id']} del grupo {envelope['g']} ya no está en {self.overflow_table}")
+                return
+            envelope = json.loads(stored)
+        await LocalChannelLayer.group_send(self, envelope['g'], envelope['m'])
+
+    def _execute(self, callback):
+        """
+        Ejecuta `callback(cursor)` en la conexión de envío (autocommit)
+        """
+        with self._send_lock:
+            if self._send_conn is None or self._send_conn.closed:
+                self._send_conn = self._connect()
+            try:
+                with self._send_conn.cursor() as cursor:
+                    return callback(cursor)
+            except psycopg2.Error:
+                self._send_conn.close()
+                raise
+
+    def _publish(self, group, payload):
+        def publish(cursor):
+            notification = payload
+            if len(payload.encode('utf-8')) > self.MAX_PAYLOAD:
+                cursor.execute(
+                    f'INSERT INTO {self.overflow_table} (payload, created_at) VALUES (%s, now()) RETURNING id',
+                    [payload]
+                )
+                notification = json.dumps({'g': group, 'id': cursor.fetchone()[0]})
+                cursor.execute(
+                    f"DELETE FROM {self.overflow_table} WHERE created_at < now() - %s * interval '1 second'",
+                    [self.overflow_ttl]
+                )
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.notify_channel, notification])
+        self._execute(publish)
+
+    def _load(self, message_id):
+        def load(cursor):
+            cursor.execute(f'SELECT payload FROM {self.overflow_table} WHERE id = %s', [message_id])
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return self._execute(load)
+
+    # Channel layer API
+
+    async def receive(self, channel):
+        await self._ensure_listening()
+        return await super().receive(channel)
+
+    async def group_add(self, group, channel):
+        await self._ensure_listening()
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        payload = json.dumps({'g': group, 'm': message}, separators=(',', ':'))
+        # El propio proceso también lo recibe por LISTEN; no se entrega dos veces
+        await asyncio.get_running_loop().run_in_executor(None, self._publish, group, payload)
+
+    async def flush(self):
+        await super().flush()
+        await self.close()
+
+    async def close(self):
+        if self._listen_task is not None and not self._listen_task.done():
+            self._listen_task.cancel()
+        self._listen_task = None
+        if self._listen_conn is not None and not self._listen_conn.closed:
+            self._listen_loop.remove_reader(self._listen_conn.fileno())
+            self._listen_conn.close()
+        self._listen_conn = None
+        with self._send_lock:
+            if self._send_conn is not None:
+                self._send_conn.close()
+                self._send_conn = None
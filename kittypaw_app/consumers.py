@@ -1,8 +1,15 @@
 import json
+import asyncio
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Device, SensorData
 from .mqtt_client import mqtt_client
+from .access import accessible_device_ids, is_admin, owner_id_for_user
+from .groups import ALL_DEVICES_GROUP, device_group, owner_group
+from .snapshot import snapshot_cache
+from .payloads import msgpack, pack, frame_to_msgpack
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,11 +23,23 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         await self.accept()
         logger.info(f"Cliente WebSocket conectado: {self.channel_name}")
         
-        # Unirse al grupo para difusión de datos
-        await self.channel_layer.group_add(
-            'sensor_data_group',
-            self.channel_name
-        )
+        self.user = self.scope.get('user') or AnonymousUser()
+        self.subscribed_groups = set()
+        # device_id visibles para el usuario; None = todos
+        self.allowed_devices = await database_sync_to_async(accessible_device_ids)(self.user)
+        self.default_groups = await self.get_default_groups()
+        
+        # Formato de las tramas: JSON (texto) o MessagePack (binario) con ?encoding=msgpack
+        self.binary = self.query_param('encoding') == 'msgpack' and msgpack is not None
+        
+        # Conflación: última lectura por (dispositivo, sensor) pendiente de envío
+        self.pending_readings = {}
+        self.update_interval = 0
+        self.flush_task = None
+        self.set_update_rate(self.query_param('rate'))
+        
+        # Unirse al ámbito por defecto: todos los collares (admin) o los del propietario
+        await self.set_groups(self.default_groups)
         
         # Enviar datos iniciales al cliente
         await self.send_initial_data()
@@ -29,121 +48,179 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         """
         Cliente se desconecta del WebSocket
         """
-        # Salir del grupo
-        await self.channel_layer.group_discard(
-            'sensor_data_group',
-            self.channel_name
-        )
+        # Salir de los grupos
+        await self.set_groups(set())
+        if self.flush_task:
+            self.flush_task.cancel()
         logger.info(f"Cliente WebSocket desconectado: {self.channel_name}")
     
-    async def receive(self, text_data):
+    async def send_frame(self, text):
+        """
+        Envía una trama JSON ya serializada en el formato de la conexión
+        """
+        if self.binary:
+            await self.send(bytes_data=frame_to_msgpack(text))
+        else:
+            await self.send(text_data=text)
+    
+    async def send_message(self, message):
+        if self.binary:
+            await self.send(bytes_data=pack(message))
+        else:
+            await self.send(text_data=json.dumps(message))
+    
+    def query_param(self, name):
+        params = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        values = params.get(name)
+        return values[0] if values else None
+    
+    def set_update_rate(self, rate):
+        """
+        Frecuencia (Hz) a la que el cliente quiere recibir lecturas. Con 0 cada
+        lectura se envía al llegar; con un valor positivo se conserva solo la
+        última por dispositivo y sensor y se envían todas juntas en cada tick.
+        """
+        try:
+            rate = float(rate or 0)
+        except (TypeError, ValueError):
+            rate = 0
+        rate = min(max(rate, 0), getattr(settings, 'WS_MAX_UPDATE_RATE', 10))
+        
+        self.update_interval = 1 / rate if rate > 0 else 0
+        if self.update_interval and self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_readings_loop())
+        elif not self.update_interval and self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+            self.pending_readings.clear()
+        return rate
+    
+    async def flush_readings_loop(self):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            if not self.pending_readings:
+                continue
+            pending, self.pending_readings = self.pending_readings, {}
+            try:
+                await self.send_message({
+                    'type': 'sensorBatch',
+                    'data': [
+                        {'deviceId': device_id, 'sensorType': sensor_type, 'value': value, 'timestamp': timestamp}
+                        for (device_id, sensor_type), (value, timestamp) in pending.items()
+                    ]
+                })
+            except Exception as e:
+                logger.error(f"Error enviando lote de lecturas al cliente WebSocket: {str(e)}")
+    
+    @database_sync_to_async
+    def get_default_groups(self):
+        if is_admin(self.user):
+            return {ALL_DEVICES_GROUP}
+        owner_id = owner_id_for_user(self.user)
+        return {owner_group(owner_id)} if owner_id else set()
+    
+    async def set_groups(self, groups):
+        """
+        Ajusta los grupos de la conexión al conjunto indicado
+        """
+        for group in self.subscribed_groups - groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in groups - self.subscribed_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.subscribed_groups = set(groups)
+    
+    async def subscribe_devices(self, device_ids):
+        """
+        Restringe la conexión a los dispositivos pedidos (p. ej. la vista de
+        detalle); deja el ámbito por defecto para no recibir tramas duplicadas
+        """
+        allowed = [
+            device_id for device_id in device_ids
+            if device_id and (self.allowed_devices is None or device_id in self.allowed_devices)
+        ]
+        denied = [device_id for device_id in device_ids if device_id not in allowed]
+        
+        groups = {group for group in self.subscribed_groups if group not in self.default_groups}
+        groups.update(device_group(device_id) for device_id in allowed)
+        await self.set_groups(groups or self.default_groups)
+        return allowed, denied
+    
+    async def unsubscribe_devices(self, device_ids):
+        groups = self.subscribed_groups - {device_group(device_id) for device_id in device_ids}
+        # Sin dispositivos explícitos se vuelve al ámbito por defecto
+        await self.set_groups(groups or self.default_groups)
+    
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Recibe datos del cliente WebSocket
         """
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None:
+                if msgpack is None:
+                    return
+                data = msgpack.unpackb(bytes_data, raw=False)
+            else:
+                data = json.loads(text_data)
             message_type = data.get('type')
             
             if message_type == 'subscribe':
                 topic = data.get('topic')
                 if topic:
-                    # Llamar a método síncrono en un hilo separado
+                    # Solo en memoria de este proceso: un WebSocket no persiste tópicos
                     await database_sync_to_async(mqtt_client.add_topic)(topic)
-                    await self.send(text_data=json.dumps({
+                    await self.send_message({
                         'type': 'subscription_success',
                         'topic': topic
-                    }))
+                    })
                     
+            elif message_type == 'subscribe_device':
+                device_ids = data.get('deviceIds') or [data.get('deviceId')]
+                allowed, denied = await self.subscribe_devices(device_ids)
+                await self.send_message({
+                    'type': 'device_subscription',
+                    'devices': allowed,
+                    'denied': denied
+                })
+                
+            elif message_type == 'set_rate':
+                rate = self.set_update_rate(data.get('rate'))
+                await self.send_message({
+                    'type': 'rate',
+                    'rate': rate
+                })
+                
+            elif message_type == 'unsubscribe_device':
+                device_ids = data.get('deviceIds') or [data.get('deviceId')]
+                await self.unsubscribe_devices(device_ids)
+                
             elif message_type == 'publish':
                 topic = data.get('topic')
                 message = data.get('message')
                 if topic and message:
                     # Llamar a método síncrono en un hilo separado
                     result = await database_sync_to_async(mqtt_client.publish)(topic, message)
-                    await self.send(text_data=json.dumps({
+                    await self.send_message({
                         'type': 'publish_result',
                         'success': result
-                    }))
+                    })
                     
-        except json.JSONDecodeError:
-            logger.error(f"Error decodificando mensaje WebSocket: {text_data}")
+        except ValueError:
+            logger.error(f"Error decodificando mensaje WebSocket: {text_data or bytes_data!r}")
         except Exception as e:
             logger.error(f"Error procesando mensaje WebSocket: {str(e)}")
     
-    @database_sync_to_async
-    def get_devices(self):
-        """
-        Obtiene todos los dispositivos
-        """
-        return list(Device.objects.all().values())
-    
-    @database_sync_to_async
-    def get_recent_sensor_data(self, device_id, limit=60):
-        """
-        Obtiene los datos recientes de un dispositivo
-        """
-        try:
-            device = Device.objects.get(device_id=device_id)
-            data = []
-            for sensor_type in ['temperature', 'humidity', 'light', 'weight']:
-                readings = SensorData.objects.filter(
-                    device=device,
-                    sensor_type=sensor_type
-                ).order_by('-timestamp')[:limit]
-                
-                sensor_data = []
-                for reading in readings:
-                    try:
-                        reading_data = json.loads(reading.data)
-                        sensor_data.append({
-                            'value': reading_data.get('value', 0),
-                            'unit': reading_data.get('unit', ''),
-                            'timestamp': reading.timestamp.isoformat()
-                        })
-                    except Exception as e:
-                        logger.error(f"Error procesando lectura: {str(e)}")
-                
-                # Invertir para que estén en orden cronológico
-                sensor_data.reverse()
-                
-                data.append({
-                    'deviceId': device_id,
-                    'sensorType': sensor_type,
-                    'data': sensor_data
-                })
-            
-            return data
-        except Device.DoesNotExist:
-            logger.warning(f"Dispositivo no encontrado: {device_id}")
-            return []
-        except Exception as e:
-            logger.error(f"Error obteniendo datos del sensor: {str(e)}")
-            return []
-    
     async def send_initial_data(self):
         """
-        Envía datos iniciales al cliente
+        Envía datos iniciales al cliente en una sola trama
         """
         try:
-            # Obtener todos los dispositivos
-            devices = await self.get_devices()
-            
-            # Enviar lista de dispositivos
-            await self.send(text_data=json.dumps({
-                'type': 'devices',
-                'data': devices
-            }))
-            
-            # Enviar datos de sensor para cada dispositivo
-            for device in devices:
-                device_id = device['device_id']
-                sensor_data = await self.get_recent_sensor_data(device_id)
-                
-                await self.send(text_data=json.dumps({
-                    'type': 'sensorData',
-                    'data': sensor_data
-                }))
-                
+            # La caché guarda el texto y su versión MessagePack: las instantáneas
+            # no pasan por la caché de tramas pequeñas de frame_to_msgpack
+            snapshot = await snapshot_cache.get(self.allowed_devices, binary=self.binary)
+            if self.binary:
+                await self.send(bytes_data=snapshot)
+            else:
+                await self.send(text_data=snapshot)
         except Exception as e:
             logger.error(f"Error enviando datos iniciales: {str(e)}")
     
@@ -151,11 +228,15 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         """
         Envía datos de sensores a los clientes WebSocket
         """
+        if self.update_interval:
+            # Cliente lento: se reemplazan los valores intermedios, la memoria no crece
+            for sensor_type, value in event['readings']:
+                self.pending_readings[(event['deviceId'], sensor_type)] = (value, event['timestamp'])
+            return
+        
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'sensorData',
-                'data': event['data']
-            }))
+            # La trama llega ya serializada desde el cliente MQTT
+            await self.send_frame(event['text'])
         except Exception as e:
             logger.error(f"Error enviando datos del sensor al cliente WebSocket: {str(e)}")
     
@@ -164,10 +245,6 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         Envía actualizaciones de estado de dispositivos a los clientes WebSocket
         """
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'deviceStatus',
-                'deviceId': event['deviceId'],
-                'status': event['status']
-            }))
+            await self.send_frame(event['text'])
         except Exception as e:
             logger.error(f"Error enviando estado del dispositivo al cliente WebSocket: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,163 @@
+import threading
+import time
+import logging
+from django.conf import settings
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceEntry:
+    """
+    Copia en memoria de los campos de Device que usa la ingesta MQTT
+    """
+    __slots__ = ('pk', 'device_id', 'type', 'status', 'battery_level', 'owner_id', 'loaded_at')
+
+    def __init__(self, pk, device_id, type, status, battery_level, owner_id=None):
+        self.pk = pk
+        self.device_id = device_id
+        self.type = type
+        self.status = status
+        self.battery_level = battery_level
+        # Propietario de la mascota que lleva el collar, para la difusión por grupos
+        self.owner_id = owner_id
+        self.loaded_at = time.monotonic()
+
+
+class DeviceRegistry:
+    """
+    Caché local al proceso de device_id -> DeviceEntry.
+
+    Se invalida con las señales post_save/post_delete de Device (ver
+    signals.py); el TTL cubre los cambios hechos desde otros procesos. Los
+    dispositivos desconocidos también se recuerdan, con un TTL más corto,
+    para no consultar la base de datos en cada mensaje de un collar no
+    registrado.
+
+    Además mantiene el conjunto completo de device_id registrados, que la
+    suscripción comodín usa como lista de permitidos sin consultar la base
+    de datos en el hilo de red.
+    """
+    FIELDS = ('pk', 'device_id', 'type', 'status', 'battery_level', 'pet__owner_id')
+
+    def __init__(self, ttl=None, negative_ttl=None):
+        self.ttl = ttl or getattr(settings, 'MQTT_DEVICE_CACHE_TTL', 300)
+        self.negative_ttl = negative_ttl or getattr(settings, 'MQTT_DEVICE_CACHE_NEGATIVE_TTL', 30)
+        self._entries = {}
+        self._missing = {}
+        self._lock = threading.Lock()
+        self._known = None
+        self._known_at = 0.0
+        self._known_stale = True
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, device_id, now):
+        entry = self._entries.get(device_id)
+        if entry is not None and now - entry.loaded_at < self.ttl:
+            return True, entry
+        missing_since = self._missing.get(device_id)
+        if missing_since is not None and now - missing_since < self.negative_ttl:
+            return True, None
+        return False, None
+
+    def get(self, device_id):
+        """
+        Devuelve la entrada del dispositivo o None si no está registrado
+        """
+        return self.get_many([device_id]).get(device_id)
+
+    def peek(self, device_id):
+        """
+        Entrada en caché aunque haya vencido, sin consultar la base de datos;
+        apta para el hilo de red y el event loop
+        """
+        return self._entries.get(device_id)
+
+    def get_many(self, device_ids):
+        """
+        Resuelve varios dispositivos con a lo sumo una consulta para los que
+        no estén en caché. Los no registrados no aparecen en el resultado.
+        """
+        now = time.monotonic()
+        found = {}
+        pending = []
+        with self._lock:
+            for device_id in device_ids:
+                cached, entry = self._lookup(device_id, now)
+                if not cached:
+                    pending.append(device_id)
+                elif entry is not None:
+                    found[device_id] = entry
+            self.hits += len(device_ids) - len(pending)
+            self.misses += len(pending)
+
+        if pending:
+            loaded = {
+                row[1]: DeviceEntry(*row)
+                for row in Device.objects.filter(device_id__in=pending).values_list(*self.FIELDS)
+            }
+            with self._lock:
+                for device_id in pending:
+                    entry = loaded.get(device_id)
+                    if entry is None:
+                        self._missing[device_id] = now
+                    else:
+                        self._entries[device_id] = entry
+                        self._missing.pop(device_id, None)
+            found.update(loaded)
+        return found
+
+    def allows(self, device_id):
+        """
+        Comprueba el device_id contra el conjunto en memoria. Mientras el
+        conjunto no esté cargado o esté desactualizado se deja pasar: el
+        escritor vuelve a filtrar con `get_many` antes de persistir.
+        """
+        known = self._known
+        if known is None or self._known_stale:
+            return True
+        return device_id in known
+
+    def refresh_known(self, force=False):
+        """
+        Recarga el conjunto de device_id registrados si venció el TTL o fue
+        invalidado. Se llama desde el hilo escritor, nunca desde on_message.
+        """
+        now = time.monotonic()
+        if not force and not self._known_stale and now - self._known_at < self.ttl:
+            return False
+        known = frozenset(Device.objects.values_list('device_id', flat=True))
+        with self._lock:
+            self._known = known
+            self._known_at = now
+            self._known_stale = False
+        return True
+
+    def update(self, device_id, **fields):
+        """
+        Refleja en la caché un cambio ya escrito en la base de datos
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None:
+                for name, value in fields.items():
+                    setattr(entry, name, value)
+
+    def invalidate(self, device_id=None):
+        with self._lock:
+            self._known_stale = True
+            if device_id is None:
+                self._entries.clear()
+                self._missing.clear()
+            else:
+                self._entries.pop(device_id, None)
+                self._missing.pop(device_id, None)
+
+    def stats(self):
+        return {
+            'cached': len(self._entries),
+            'registered': len(self._known) if self._known is not None else None,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
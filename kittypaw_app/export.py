@@ -0,0 +1,130 @@
+import csv
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+EXPORT_COLUMNS = ['timestamp', 'sensor_type', 'value', 'unit']
+
+# Filas por viaje al cursor del servidor y por bloque enviado al cliente
+EXPORT_CHUNK_SIZE = 5000
+
+
+class Echo:
+    """
+    Pseudo-buffer para csv.writer: devuelve la línea en lugar de guardarla
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """
+    Itera las lecturas con un cursor con nombre del lado del servidor. Debe
+    consumirse dentro de una transacción: en autocommit Django declara el
+    cursor WITH HOLD y PostgreSQL materializa todo el resultado antes de
+    devolver la primera fila.
+    """
+    return (
+        queryset
+        .order_by('timestamp', 'id')
+        .values_list(*EXPORT_COLUMNS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def encode_csv(chunk, writer):
+    return ''.join(
+        writer.writerow([timestamp.isoformat(), sensor_type, value, unit])
+        for timestamp, sensor_type, value, unit in chunk
+    )
+
+
+def encode_ndjson(chunk):
+    return ''.join(
+        json.dumps({
+            'timestamp': timestamp.isoformat(),
+            'sensor_type': sensor_type,
+            'value': value,
+            'unit': unit
+        }) + '\n'
+        for timestamp, sensor_type, value, unit in chunk
+    )
+
+
+def export_stream(queryset, export_format, asynchronous=False):
+    """
+    Devuelve el cuerpo de la exportación como iterador de bloques de texto.
+
+    Con ASGI se devuelve un iterador asíncrono: Django materializa en memoria
+    los iteradores síncronos al servirlos de forma asíncrona. La transacción
+    se abre, cada bloque se lee y la transacción se cierra en el mismo hilo
+    (sync_to_async con thread_sensitive), que conserva la conexión del cursor.
+    """
+    writer = csv.writer(Echo())
+    if export_format == 'ndjson':
+        header = ''
+        encode = encode_ndjson
+    else:
+        header = writer.writerow(EXPORT_COLUMNS)
+        encode = lambda chunk: encode_csv(chunk, writer)
+
+    if asynchronous:
+        cursor = ExportCursor(queryset)
+
+        async def stream():
+            if header:
+                yield header
+            await sync_to_async(cursor.open, thread_sensitive=True)()
+            try:
+                fetch = sync_to_async(cursor.fetch, thread_sensitive=True)
+                while True:
+                    chunk = await fetch()
+                    if not chunk:
+                        break
+                    yield encode(chunk)
+            finally:
+                await sync_to_async(cursor.close, thread_sensitive=True)()
+        return stream()
+
+    def stream():
+        if header:
+            yield header
+        with transaction.atomic():
+            rows = export_rows(queryset)
+            while True:
+                chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                yield encode(chunk)
+    return stream()
+
+
+class ExportCursor:
+    """
+    Transacción y cursor de una exportación servida por ASGI, abiertos y
+    cerrados en llamadas separadas desde el mismo hilo
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.atomic = None
+        self.rows = None
+
+    def open(self):
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        self.rows = export_rows(self.queryset)
+
+    def fetch(self):
+        return list(islice(self.rows, EXPORT_CHUNK_SIZE))
+
+    def close(self):
+        if self.atomic is None:
+            return
+        # Cerrar el cursor con nombre antes de terminar la transacción; es
+        # de solo lectura, así que se revierte siempre, también tras un error
+        self.rows.close()
+        transaction.set_rollback(True)
+        self.atomic.__exit__(None, None, None)
+        self.atomic = None
@@ -0,0 +1,28 @@
+"""
+Nombres de grupos del channel layer para la difusión de lecturas.
+
+Cada lectura se envía al grupo de su dispositivo, al de su propietario y al
+de administradores; cada conexión WebSocket está en uno solo de esos ámbitos
+para no recibir la misma trama dos veces.
+"""
+import re
+
+# Administradores: reciben todos los dispositivos
+ALL_DEVICES_GROUP = 'devices_all'
+
+_INVALID = re.compile(r'[^0-9A-Za-z_.-]')
+
+
+def device_group(device_id):
+    return f"device_{_INVALID.sub('_', str(device_id))}"[:99]
+
+
+def owner_group(owner_id):
+    return f"owner_{owner_id}"
+
+
+def groups_for_device(device_id, owner_id=None):
+    groups = [device_group(device_id), ALL_DEVICES_GROUP]
+    if owner_id is not None:
+        groups.append(owner_group(owner_id))
+    return groups
@@ -0,0 +1,335 @@
+import queue
+import threading
+import time
+import atexit
+import logging
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+from .models import Device, SensorData, LatestSensorReading
+
+logger = logging.getLogger(__name__)
+
+
+class IngestItem:
+    """
+    Mensaje MQTT ya decodificado, listo para ser persistido por el escritor
+    """
+    __slots__ = ('device_id', 'status', 'battery', 'timestamp', 'readings')
+
+    def __init__(self, device_id, status, battery, timestamp, readings):
+        self.device_id = device_id
+        self.status = status
+        self.battery = battery
+        self.timestamp = timestamp
+        # Lista de tuplas (sensor_type, value, unit)
+        self.readings = readings
+
+
+def upsert_latest_readings(readings):
+    """
+    Inserta o actualiza LatestSensorReading con (device_id, sensor_type,
+    value, unit, timestamp), sin retroceder nunca: una lectura atrasada (reloj
+    del collar desfasado, muestras antiguas de un paquete MessagePack) no
+    reemplaza a una más reciente ya guardada. bulk_create no admite la
+    condición WHERE del ON CONFLICT, por eso la sentencia es explícita.
+    """
+    if not readings:
+        return
+    table = connection.ops.quote_name(LatestSensorReading._meta.db_table)
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    params = []
+    for device_id, sensor_type, value, unit, timestamp in readings:
+        params += [device_id, sensor_type, value, unit, connection.ops.adapt_datetimefield_value(timestamp), updated_at]
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(readings))
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO {table} (device_id, sensor_type, value, unit, "timestamp", updated_at)
+            VALUES {values}
+            ON CONFLICT (device_id, sensor_type) DO UPDATE SET
+                value = EXCLUDED.value,
+                unit = EXCLUDED.unit,
+                "timestamp" = EXCLUDED."timestamp",
+                updated_at = EXCLUDED.updated_at
+            WHERE EXCLUDED."timestamp" >= {table}."timestamp"
+        ''', params)
+
+
+class DeviceStateBuffer:
+    """
+    Capa write-behind para estado, batería y last_update de los dispositivos.
+
+    Los cambios se aplican de inmediato en la caché de dispositivos y se
+    acumulan en memoria; `flush` los escribe con un `bulk_update` por cada
+    combinación de campos modificados, solo para los dispositivos que cambiaron.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.written_devices = 0
+
+    def _mark(self, device_id, **changes):
+        with self._lock:
+            self._pending.setdefault(device_id, {}).update(changes)
+
+    def set_status(self, device_id, status):
+        """
+        Registra un nuevo estado; devuelve True solo si realmente cambió
+        """
+        device = self.registry.get(device_id)
+        if device is None or device.status == status:
+            return False
+        self.registry.update(device_id, status=status)
+        self._mark(device_id, status=status, last_update=timezone.now())
+        return True
+
+    def set_battery(self, device_id, battery):
+        device = self.registry.get(device_id)
+        if device is None or device.battery_level == battery:
+            return False
+        self.registry.update(device_id, battery_level=battery)
+        self._mark(device_id, battery_level=battery)
+        return True
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # Agrupar por conjunto de campos para no sobrescribir columnas que no cambiaron
+        groups = {}
+        for device_id, changes in pending.items():
+            device = self.registry.get(device_id)
+            if device is None:
+                continue
+            obj = Device(pk=device.pk, device_id=device_id, **changes)
+            groups.setdefault(tuple(sorted(changes)), []).append(obj)
+
+        try:
+            with transaction.atomic():
+                for fields, objs in groups.items():
+                    Device.objects.bulk_update(objs, fields=list(fields))
+        except DatabaseError as e:
+            logger.error(f"Error actualizando estado de {len(pending)} dispositivos: {str(e)}")
+            # Devolver los cambios a la cola sin pisar los más recientes
+            with self._lock:
+                for device_id, changes in pending.items():
+                    self._pending[device_id] = {**changes, **self._pending.get(device_id, {})}
+            connection.close()
+            return 0
+
+        self.flushes += 1
+        self.written_devices += len(pending)
+        return len(pending)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'flushes': self.flushes,
+            'writtenDevices': self.written_devices,
+        }
+
+
+class SensorDataWriter:
+    """
+    Etapa de ingesta desacoplada del hilo de red de paho.
+
+    `submit` solo encola; un hilo escritor agrupa los mensajes y persiste las
+    lecturas con `bulk_create` cuando se alcanza `batch_size` filas o cuando
+    pasa `flush_interval` segundos desde el primer mensaje pendiente.
+    """
+
+    def __init__(self, registry, device_state, device_state_handler=None, batch_size=None, flush_interval=None, max_queue=None):
+        self.batch_size = batch_size or getattr(settings, 'MQTT_INGEST_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'MQTT_INGEST_FLUSH_INTERVAL', 0.25)
+        self.max_queue = max_queue or getattr(settings, 'MQTT_INGEST_QUEUE_SIZE', 10000)
+        self.state_flush_interval = getattr(settings, 'MQTT_DEVICE_STATE_FLUSH_INTERVAL', 1.0)
+        self.registry = registry
+        self.device_state = device_state
+        self.device_state_handler = device_state_handler
+        self.queue = queue.Queue(maxsize=self.max_queue)
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+        # Métricas de contrapresión
+        self.enqueued = 0
+        self.dropped = 0
+        self.written_rows = 0
+        self.failed_rows = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.last_batch_rows = 0
+
+    def start(self):
+        with self._lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self._stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='kittypaw-ingest', daemon=True)
+            self.thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+        logger.info(f"Escritor de ingesta iniciado (lote={self.batch_size}, intervalo={self.flush_interval}s)")
+
+    def stop(self, timeout=10.0):
+        """
+        Detiene el escritor vaciando la cola antes de salir
+        """
+        with self._lock:
+            thread = self.thread
+            if not thread or not thread.is_alive():
+                return
+            self._stop_event.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"El escritor de ingesta no terminó en {timeout}s; quedan {self.queue.qsize()} mensajes")
+        else:
+            logger.info("Escritor de ingesta detenido")
+
+    def submit(self, item):
+        """
+        Encola un mensaje sin bloquear; si la cola está llena se descarta
+        """
+        try:
+            self.queue.put_nowait(item)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            # Evitar inundar el log cuando el escritor va atrasado
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Cola de ingesta llena ({self.max_queue}); mensajes descartados: {self.dropped}")
+            return False
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'maxQueue': self.max_queue,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'writtenRows': self.written_rows,
+            'failedRows': self.failed_rows,
+            'flushes': self.flushes,
+            'lastFlushMs': round(self.last_flush_ms, 2),
+            'lastBatchRows': self.last_batch_rows,
+            'running': bool(self.thread and self.thread.is_alive()),
+        }
+
+    def _run(self):
+        batch = []
+        rows = 0
+        deadline = None
+        next_state_flush = time.monotonic() + self.state_flush_interval
+        while True:
+            wake = min(deadline, next_state_flush) if batch else next_state_flush
+            try:
+                item = self.queue.get(timeout=max(0.0, wake - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                rows += len(item.readings)
+
+            if self._stop_event.is_set():
+                # Vaciar lo que quede en la cola y salir
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._flush(batch)
+                self.device_state.flush()
+                return
+
+            now = time.monotonic()
+            if batch and (rows >= self.batch_size or now >= deadline):
+                self._flush(batch)
+                batch = []
+                rows = 0
+
+            # Estado y batería se escriben por intervalo, no por mensaje
+            if now >= next_state_flush:
+                self.device_state.flush()
+                self._refresh_registry()
+                next_state_flush = now + self.state_flush_interval
+
+    def _refresh_registry(self):
+        # Lista de permitidos de la suscripción comodín
+        try:
+            self.registry.refresh_known()
+        except DatabaseError as e:
+            logger.error(f"Error recargando dispositivos registrados: {str(e)}")
+            connection.close()
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        device_ids = {item.device_id for item in batch}
+        try:
+            known = set(self.registry.get_many(device_ids))
+            unknown = device_ids - known
+            if unknown:
+                logger.warning(f"Lecturas descartadas de dispositivos no registrados: {', '.join(sorted(unknown))}")
+
+            objs = []
+            latest = {}
+            device_state = {}
+            for item in batch:
+                if item.device_id not in known:
+                    continue
+                device_state[item.device_id] = (item.status, item.battery)
+                iso_timestamp = item.timestamp.isoformat()
+                for sensor_type, value, unit in item.readings:
+                    key = (item.device_id, sensor_type)
+                    current = latest.get(key)
+                    if current is None or item.timestamp >= current[4]:
+                        latest[key] = (item.device_id, sensor_type, value, unit, item.timestamp)
+                    objs.append(SensorData(
+                        device_id=item.device_id,
+                        timestamp=item.timestamp,
+                        sensor_type=sensor_type,
+                        value=value,
+                        unit=unit,
+                        data={
+                            'value': value,
+                            'unit': unit,
+                            'timestamp': iso_timestamp
+                        }
+                    ))
+
+            if objs:
+                with transaction.atomic():
+                    SensorData.objects.bulk_create(objs, batch_size=self.batch_size)
+                    # Una fila por dispositivo y tipo de sensor con el último valor
+                    upsert_latest_readings(list(latest.values()))
+            self.written_rows += len(objs)
+            self.last_batch_rows = len(objs)
+
+            # Solo se aplica el último estado/batería recibido de cada dispositivo
+            if self.device_state_handler:
+                for device_id, (status, battery) in device_state.items():
+                    self.device_state_handler(device_id, status, battery)
+        except DatabaseError as e:
+            failed = sum(len(item.readings) for item in batch)
+            self.failed_rows += failed
+            logger.error(f"Error guardando lote de {failed} lecturas: {str(e)}")
+            # Forzar reconexión en el siguiente lote
+            connection.close()
+        except Exception as e:
+            logger.error(f"Error procesando lote de ingesta: {str(e)}")
+        finally:
+            self.flushes += 1
+            self.last_flush_ms = (time.monotonic() - started) * 1000
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MqttEngineMiddleware:
+    """
+    Middleware ASGI que arranca y detiene el cliente MQTT del proceso web
+    cuando MQTT_ENGINE lo pide ('thread' o 'asyncio', solo para desarrollo).
+
+    Con servidores que implementan el protocolo lifespan (uvicorn, hypercorn)
+    el cliente se conecta en `lifespan.startup`. Daphne no envía lifespan:
+    kittypaw_project.server llama a `ensure_started` y `stop` cuando el
+    reactor arranca y se detiene. Con un daphne sin ese arranque la conexión
+    se abre, como último recurso, con la primera conexión entrante.
+    Con MQTT_ENGINE='external', el valor por defecto, la ingesta corre en
+    `manage.py run_ingest` y ningún worker web se conecta al broker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = getattr(settings, 'MQTT_ENGINE', 'external') != 'external'
+        self._started = False
+
+    async def startup(self):
+        from .mqtt_client import mqtt_client
+        from .mqtt_async import AsyncMqttClient
+        if isinstance(mqtt_client, AsyncMqttClient):
+            await mqtt_client.start()
+        else:
+            await sync_to_async(mqtt_client.load_and_connect, thread_sensitive=False)()
+        logger.info("Cliente MQTT inicializado")
+
+    async def shutdown(self):
+        from .mqtt_client import mqtt_client
+        from .mqtt_async import AsyncMqttClient
+        if isinstance(mqtt_client, AsyncMqttClient):
+            await mqtt_client.stop()
+        else:
+            await sync_to_async(mqtt_client.disconnect, thread_sensitive=False)()
+
+    async def stop(self):
+        if self._started:
+            self._started = False
+            await self.shutdown()
+
+    def ensure_started(self):
+        if self.enabled and not self._started:
+            self._started = True
+            asyncio.get_running_loop().create_task(self.startup())
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    if self.enabled and not self._started:
+                        self._started = True
+                        await self.startup()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await self.stop()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        self.ensure_started()
+        return await self.app(scope, receive, send)
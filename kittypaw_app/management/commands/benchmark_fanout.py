@@ -0,0 +1,59 @@
+import asyncio
+import statistics
+import time
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia de difusión del channel layer configurado para N clientes simulados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[1000, 10000],
+                            help='Cantidades de clientes a simular (p. ej. 1000 10000)')
+        parser.add_argument('--messages', type=int, default=50,
+                            help='Mensajes difundidos por cada cantidad de clientes')
+        parser.add_argument('--layer', default='default',
+                            help='Alias de CHANNEL_LAYERS a medir')
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer(options['layer'])
+        self.stdout.write(f"Channel layer: {type(layer).__module__}.{type(layer).__name__}")
+        for clients in options['clients']:
+            latencies = asyncio.run(self.measure(layer, clients, options['messages']))
+            latencies.sort()
+            self.stdout.write(
+                f"{clients} clientes, {len(latencies)} mensajes: "
+                f"p50={self.ms(statistics.median(latencies))} "
+                f"p95={self.ms(latencies[int(len(latencies) * 0.95) - 1])} "
+                f"max={self.ms(latencies[-1])}"
+            )
+
+    @staticmethod
+    def ms(seconds):
+        return f"{seconds * 1000:.1f}ms"
+
+    async def measure(self, layer, clients, messages):
+        """
+        Une `clients` canales a un grupo y mide, por mensaje, el tiempo desde
+        group_send hasta que el último cliente lo recibe
+        """
+        group = 'benchmark_fanout'
+        channels = [await layer.new_channel() for _ in range(clients)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+
+        latencies = []
+        try:
+            for index in range(messages):
+                started = time.perf_counter()
+                receivers = [asyncio.ensure_future(layer.receive(channel)) for channel in channels]
+                await layer.group_send(group, {'type': 'benchmark', 'n': index})
+                await asyncio.gather(*receivers)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            for channel in channels:
+                await layer.group_discard(group, channel)
+            if hasattr(layer, 'close'):
+                await layer.close()
+        return latencies
@@ -0,0 +1,39 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from kittypaw_app.snapshot import build_snapshot, snapshot_query
+
+
+class Command(BaseCommand):
+    help = 'Mide la construcción de la instantánea inicial del WebSocket sobre la base de datos configurada'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', nargs='*',
+                            help='device_id a incluir (por defecto todos, como un administrador)')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Construcciones a medir')
+        parser.add_argument('--explain', action='store_true',
+                            help='Muestra EXPLAIN (ANALYZE, BUFFERS) de la consulta de lecturas')
+
+    def handle(self, *args, **options):
+        device_ids = options['devices'] or None
+
+        if options['explain']:
+            sql, params = snapshot_query(device_ids)
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+                for (line,) in cursor.fetchall():
+                    self.stdout.write(line)
+
+        timings = []
+        size = 0
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            size = len(build_snapshot(device_ids))
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f"{options['repeat']} instantáneas de {size} bytes: "
+            f"p50={statistics.median(timings) * 1000:.1f}ms max={timings[-1] * 1000:.1f}ms"
+        )
@@ -0,0 +1,90 @@
+import json
+import random
+import time
+import zlib
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from kittypaw_app.payloads import SENSOR_TYPES, msgpack, pack
+from kittypaw_app.snapshot import SNAPSHOT_READINGS, build_snapshot
+
+
+def deflate(data):
+    # Equivalente a permessage-deflate con los parámetros por defecto
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def synthetic_snapshot(devices):
+    """
+    Instantánea con la forma de build_snapshot, sin base de datos
+    """
+    now = timezone.now()
+    device_rows = []
+    series = []
+    for index in range(devices):
+        device_id = f"KPCL{index:04d}"
+        device_rows.append({
+            'id': index + 1, 'device_id': device_id, 'name': f"Collar {index}", 'type': 'KPCL',
+            'ip_address': None, 'status': 'online', 'battery_level': random.randint(5, 100),
+            'last_update': now.isoformat(),
+        })
+        for sensor_type in SENSOR_TYPES:
+            series.append({
+                'deviceId': device_id,
+                'sensorType': sensor_type,
+                'data': [
+                    {'value': round(random.uniform(0, 40), 2), 'unit': '',
+                     'timestamp': (now - timedelta(seconds=SNAPSHOT_READINGS - n)).isoformat()}
+                    for n in range(SNAPSHOT_READINGS)
+                ],
+            })
+    return json.dumps({'type': 'snapshot', 'devices': device_rows, 'sensorData': series})
+
+
+def synthetic_update():
+    return json.dumps({
+        'type': 'sensorData',
+        'deviceId': 'KPCL0001',
+        'data': {'device_id': 'KPCL0001', 'temperature': 21.5, 'humidity': 40.2, 'light': 310,
+                 'weight': 4.21, 'battery': 87, 'timestamp': '17/10/2026, 10:00:01'},
+    })
+
+
+class Command(BaseCommand):
+    help = 'Compara tamaño y costo de CPU de las tramas WebSocket en JSON y MessagePack, con y sin deflate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=0,
+                            help='Usa una instantánea sintética con N dispositivos en lugar de la base de datos')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Repeticiones para medir el tiempo de codificación')
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError("Instale 'msgpack' (pip install .[binary]) para comparar el formato binario")
+
+        snapshot = synthetic_snapshot(options['devices']) if options['devices'] else build_snapshot()
+        for name, text in (('snapshot', snapshot), ('actualización', synthetic_update())):
+            self.report(name, text, options['repeat'])
+
+    def report(self, name, text, repeat):
+        obj = json.loads(text)
+        variants = {
+            'json': lambda: text.encode('utf-8'),
+            'json+deflate': lambda: deflate(text.encode('utf-8')),
+            'msgpack': lambda: pack(obj),
+            'msgpack+deflate': lambda: deflate(pack(obj)),
+        }
+        self.stdout.write(f"Trama {name}:")
+        baseline = None
+        for variant, encode in variants.items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                data = encode()
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            size = len(data)
+            baseline = baseline or size
+            self.stdout.write(
+                f"  {variant:<16} {size:>10} bytes ({size / baseline:6.1%})  {elapsed:8.3f} ms/trama"
+            )
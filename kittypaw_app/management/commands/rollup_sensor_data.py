@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from kittypaw_app.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Actualiza los rollups de 1 minuto, 1 hora y 1 día con las lecturas nuevas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help='Máximo de ids de SensorData a procesar por pasada')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Si se indica, repite cada N segundos en lugar de ejecutar una vez')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            # Vaciar el atraso antes de esperar al siguiente ciclo
+            total = 0
+            while True:
+                processed = refresh_rollups(batch_size=batch_size)
+                total += processed
+                if processed < batch_size:
+                    break
+            self.stdout.write(f"Filas incorporadas a rollups: {total}")
+
+            if not interval:
+                return
+            time.sleep(interval)
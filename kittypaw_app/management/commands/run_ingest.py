@@ -0,0 +1,103 @@
+import signal
+import subprocess
+import sys
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from kittypaw_app.mqtt_client import MqttClient
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta la ingesta MQTT en procesos dedicados, repartiendo la carga entre N workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Número de procesos de ingesta')
+        parser.add_argument('--mode', choices=['share', 'hash'], default='share',
+                            help="'share': suscripción compartida MQTT v5; 'hash': reparto de tópicos por crc32 "
+                                 "(sin MQTT_WILDCARD_TOPIC)")
+        parser.add_argument('--group', default='kittypaw',
+                            help='Grupo de la suscripción compartida ($share/<grupo>/+/pub)')
+        parser.add_argument('--client-id', default='kittypaw_ingest',
+                            help='Prefijo del client_id; cada worker añade su índice')
+        parser.add_argument('--worker-index', type=int, default=None,
+                            help='Uso interno: índice del worker lanzado por el supervisor')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers debe ser al menos 1')
+        if options['mode'] == 'hash' and getattr(settings, 'MQTT_WILDCARD_TOPIC', '+/pub'):
+            # Validado antes de lanzar workers que el supervisor relanzaría sin fin
+            raise CommandError(
+                "El modo 'hash' necesita tópicos por dispositivo: use --mode share "
+                "o deje MQTT_WILDCARD_TOPIC vacío"
+            )
+
+        if options['worker_index'] is not None:
+            return self.run_worker(options['worker_index'], workers, options)
+        if workers == 1:
+            return self.run_worker(0, 1, options)
+        return self.supervise(workers, options)
+
+    def run_worker(self, index, workers, options):
+        """
+        Conecta este proceso al broker con su parte de las suscripciones y
+        bloquea hasta recibir SIGINT/SIGTERM; al salir vacía el escritor
+        """
+        stop = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        # Cliente de hilos propio: el global puede ser el motor asyncio, que
+        # necesita el event loop del servidor ASGI
+        mqtt_client = MqttClient()
+        mqtt_client.configure_shard(index, workers, mode=options['mode'], group=options['group'])
+        params = mqtt_client.get_connection_params()
+        params['client_id'] = f"{options['client_id']}-{index}"
+        if not mqtt_client.connect(**params):
+            raise CommandError(f"Worker {index}: no se pudo conectar al broker")
+
+        self.stdout.write(f"Worker {index}/{workers} de ingesta en ejecución (modo {options['mode']})")
+        stop.wait()
+        mqtt_client.disconnect()
+        self.stdout.write(f"Worker {index} detenido")
+
+    def supervise(self, workers, options):
+        """
+        Lanza un subproceso por worker y los relanza si terminan inesperadamente
+        """
+        base = [sys.executable, sys.argv[0], 'run_ingest',
+                '--workers', str(workers),
+                '--mode', options['mode'],
+                '--group', options['group'],
+                '--client-id', options['client_id']]
+        stopping = threading.Event()
+
+        def spawn(index):
+            return subprocess.Popen(base + ['--worker-index', str(index)])
+
+        def handle_signal(sig, frame):
+            stopping.set()
+
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+
+        processes = {index: spawn(index) for index in range(workers)}
+        self.stdout.write(f"Supervisor de ingesta: {workers} workers en modo {options['mode']}")
+
+        while not stopping.is_set():
+            for index, process in processes.items():
+                if process.poll() is not None:
+                    self.stderr.write(f"Worker {index} terminó con código {process.returncode}; relanzando")
+                    processes[index] = spawn(index)
+            stopping.wait(5)
+
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.stdout.write("Ingesta detenida")
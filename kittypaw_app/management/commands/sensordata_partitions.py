@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from kittypaw_app.partitions import create_future_partitions, drop_expired_partitions
+
+
+class Command(BaseCommand):
+    help = 'Crea particiones mensuales futuras de SensorData y elimina las que exceden la retención'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int,
+                            default=getattr(settings, 'SENSOR_DATA_PARTITIONS_AHEAD', 3),
+                            help='Meses futuros para los que se crean particiones')
+        parser.add_argument('--retention-months', type=int,
+                            default=getattr(settings, 'SENSOR_DATA_RETENTION_MONTHS', 12),
+                            help='Meses completos de lecturas a conservar (0 desactiva la retención)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Muestra las particiones que se eliminarían sin tocarlas')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            for name in create_future_partitions(options['months_ahead']):
+                self.stdout.write(f"Creada: {name}")
+
+        if options['retention_months'] > 0:
+            dropped = drop_expired_partitions(options['retention_months'], dry_run=options['dry_run'])
+            label = 'Se eliminaría' if options['dry_run'] else 'Eliminada'
+            for name in dropped:
+                self.stdout.write(f"{label}: {name}")
@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from .models import Device, LatestSensorReading
+
+logger = logging.getLogger(__name__)
+
+
+def compute_metrics():
+    """
+    Métricas del dashboard. Los sensores activos (los que han enviado datos
+    en la última hora) se cuentan sobre la proyección de últimas lecturas, que
+    tiene una fila por dispositivo y tipo de sensor, en lugar de un DISTINCT
+    sobre la última hora de SensorData.
+    """
+    one_hour_ago = timezone.now() - timezone.timedelta(hours=1)
+    return {
+        'activeDevices': Device.objects.filter(status='online').count(),
+        'activeSensors': LatestSensorReading.objects.filter(timestamp__gte=one_hour_ago).count(),
+        'alerts': 0,  # No hay sistema de alertas implementado aún
+        'lastUpdate': timezone.now().isoformat()
+    }
+
+
+class SystemMetricsCache:
+    """
+    Métricas compartidas entre usuarios y procesos a través de la caché de
+    Django, recalculadas como mucho una vez cada `interval` segundos.
+
+    Una entrada vencida se sigue sirviendo mientras un hilo en segundo plano
+    la recalcula; el cerrojo en la caché (cache.add) garantiza un único
+    recálculo en curso entre todos los procesos. Solo la primera petición,
+    con la caché vacía, espera el cálculo.
+    """
+    KEY = 'system:metrics'
+    REFRESH_LOCK_KEY = 'system:metrics:refreshing'
+    # Si el hilo de recálculo muere sin liberar el cerrojo, vence solo
+    REFRESH_LOCK_TIMEOUT = 60
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else getattr(settings, 'SYSTEM_METRICS_INTERVAL', 10)
+        self._lock = threading.Lock()
+
+    def get(self):
+        entry = cache.get(self.KEY)
+        if entry is None:
+            with self._lock:
+                entry = cache.get(self.KEY)
+                if entry is None:
+                    entry = self._store(compute_metrics())
+        elif entry['computed_at'] + self.interval <= time.time():
+            self.refresh_in_background()
+        return entry['metrics']
+
+    def refresh_in_background(self):
+        if not cache.add(self.REFRESH_LOCK_KEY, True, self.REFRESH_LOCK_TIMEOUT):
+            return
+        threading.Thread(target=self._refresh, name='system-metrics-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self._store(compute_metrics())
+        except Exception as e:
+            logger.error(f"Error recalculando las métricas del sistema: {str(e)}")
+        finally:
+            cache.delete(self.REFRESH_LOCK_KEY)
+            # El hilo termina: su conexión no vuelve a usarse
+            connection.close()
+
+    def _store(self, metrics):
+        entry = {'metrics': metrics, 'computed_at': time.time()}
+        cache.set(self.KEY, entry, None)
+        return entry
+
+
+system_metrics = SystemMetricsCache()
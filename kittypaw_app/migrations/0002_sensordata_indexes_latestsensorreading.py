@@ -0,0 +1,70 @@
+import json
+
+import django.db.models.deletion
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import migrations, models
+
+
+def backfill_latest_readings(apps, schema_editor):
+    SensorData = apps.get_model('kittypaw_app', 'SensorData')
+    LatestSensorReading = apps.get_model('kittypaw_app', 'LatestSensorReading')
+
+    latest = (
+        SensorData.objects
+        .order_by('device_id', 'sensor_type', '-timestamp')
+        .distinct('device_id', 'sensor_type')
+    )
+    rows = []
+    for reading in latest.iterator(chunk_size=1000):
+        data = reading.data
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                continue
+        try:
+            value = float(data.get('value', 0))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        rows.append(LatestSensorReading(
+            device_id=reading.device_id,
+            sensor_type=reading.sensor_type,
+            value=value,
+            unit=data.get('unit', ''),
+            timestamp=reading.timestamp,
+        ))
+    LatestSensorReading.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kittypaw_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=models.Index(fields=['device', 'sensor_type', '-timestamp'], name='sensordata_dev_type_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=BrinIndex(fields=['timestamp'], name='sensordata_ts_brin'),
+        ),
+        migrations.CreateModel(
+            name='LatestSensorReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_type', models.CharField(max_length=50)),
+                ('value', models.FloatField()),
+                ('unit', models.CharField(blank=True, default='', max_length=20)),
+                ('timestamp', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(db_column='device_id', on_delete=django.db.models.deletion.CASCADE, related_name='latest_readings', to='kittypaw_app.device', to_field='device_id')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'sensor_type'), name='latest_reading_device_type_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_latest_readings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+import json
+
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 5000
+VALID_UNITS = {'°C', '%', 'lux', 'kg'}
+
+
+def backfill_value_unit(apps, schema_editor):
+    """
+    Copia `value` y `unit` desde el JSON de cada lectura y normaliza `data`
+    (antes guardado como cadena JSON) a objeto. Se procesa por bloques de
+    claves primarias para no bloquear la tabla completa.
+    """
+    SensorData = apps.get_model('kittypaw_app', 'SensorData')
+    last_pk = 0
+    while True:
+        chunk = list(
+            SensorData.objects
+            .filter(pk__gt=last_pk, value__isnull=True)
+            .order_by('pk')
+            .only('pk', 'data')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+
+        updated = []
+        for reading in chunk:
+            data = reading.data
+            if isinstance(data, str):
+                try:
+                    data = json.loads(data)
+                except ValueError:
+                    continue
+            if not isinstance(data, dict):
+                continue
+            try:
+                reading.value = float(data.get('value'))
+            except (TypeError, ValueError):
+                continue
+            unit = data.get('unit', '')
+            reading.unit = unit if unit in VALID_UNITS else ''
+            reading.data = data
+            updated.append(reading)
+
+        SensorData.objects.bulk_update(updated, ['value', 'unit', 'data'])
+
+
+class Migration(migrations.Migration):
+
+    # Cada bloque del back-fill se confirma por separado
+    atomic = False
+
+    dependencies = [
+        ('kittypaw_app', '0002_sensordata_indexes_latestsensorreading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensordata',
+            name='value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sensordata',
+            name='unit',
+            field=models.CharField(blank=True, choices=[('°C', 'Grados Celsius'), ('%', 'Porcentaje'), ('lux', 'Lux'), ('kg', 'Kilogramos'), ('', 'Sin unidad')], default='', max_length=8),
+        ),
+        migrations.RunPython(backfill_value_unit, migrations.RunPython.noop),
+    ]
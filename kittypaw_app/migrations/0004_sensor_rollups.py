@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rollup_fields():
+    return [
+        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+        ('sensor_type', models.CharField(max_length=50)),
+        ('bucket', models.DateTimeField()),
+        ('sample_count', models.BigIntegerField(default=0)),
+        ('value_sum', models.FloatField(default=0)),
+        ('value_min', models.FloatField(blank=True, null=True)),
+        ('value_max', models.FloatField(blank=True, null=True)),
+        ('device', models.ForeignKey(db_column='device_id', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='kittypaw_app.device', to_field='device_id')),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kittypaw_app', '0003_sensordata_value_unit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollupMinute',
+            fields=rollup_fields(),
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'sensor_type', 'bucket'), name='rollup_minute_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupHour',
+            fields=rollup_fields(),
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'sensor_type', 'bucket'), name='rollup_hour_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SensorRollupDay',
+            fields=rollup_fields(),
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'sensor_type', 'bucket'), name='rollup_day_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('pending_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,129 @@
+"""
+Convierte kittypaw_app_sensordata en una tabla particionada por rango mensual
+de `timestamp`. El modelo de Django no cambia: solo cambia el almacenamiento.
+
+PostgreSQL exige que la clave primaria incluya la columna de partición, por
+lo que la PK pasa a ser (id, timestamp); `id` sigue saliendo de una secuencia
+y es único en la práctica. Las particiones futuras y la retención se
+gestionan con `manage.py sensordata_partitions`. La reversión vuelve a una
+tabla sin particionar con todas las filas.
+"""
+from datetime import date
+
+from django.conf import settings
+from django.db import migrations
+
+TABLE = 'kittypaw_app_sensordata'
+LEGACY = 'kittypaw_app_sensordata_legacy'
+SEQUENCE = 'kittypaw_app_sensordata_id_part_seq'
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_sensor_data(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        # Liberar el nombre de la tabla y de los índices existentes
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY}')
+        cursor.execute(f'ALTER TABLE {LEGACY} RENAME CONSTRAINT {TABLE}_pkey TO {LEGACY}_pkey')
+        cursor.execute('DROP INDEX IF EXISTS sensordata_dev_type_ts_idx')
+        cursor.execute('DROP INDEX IF EXISTS sensordata_ts_brin')
+
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE}')
+        cursor.execute(f'''
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+                "timestamp" timestamp with time zone NOT NULL,
+                data jsonb NOT NULL,
+                sensor_type varchar(50) NOT NULL,
+                device_id varchar(50) NOT NULL,
+                value double precision NULL,
+                unit varchar(8) NOT NULL,
+                CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp"),
+                CONSTRAINT sensordata_device_id_fk FOREIGN KEY (device_id)
+                    REFERENCES kittypaw_app_device (device_id) DEFERRABLE INITIALLY DEFERRED
+            ) PARTITION BY RANGE ("timestamp")
+        ''')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+
+        # Una partición por mes desde la lectura más antigua hasta
+        # SENSOR_DATA_PARTITIONS_AHEAD meses en el futuro, más una partición
+        # por defecto para fechas fuera de rango
+        cursor.execute(f'SELECT MIN("timestamp") FROM {LEGACY}')
+        oldest = cursor.fetchone()[0]
+        today = date.today().replace(day=1)
+        month = oldest.date().replace(day=1) if oldest else today
+        last = add_months(today, getattr(settings, 'SENSOR_DATA_PARTITIONS_AHEAD', 3))
+        while month <= last:
+            following = add_months(month, 1)
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_p{month.year}_{month.month:02d} PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            )
+            month = following
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'''
+            INSERT INTO {TABLE} (id, "timestamp", data, sensor_type, device_id, value, unit)
+            SELECT id, "timestamp", data, sensor_type, device_id, value, unit FROM {LEGACY}
+        ''')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)")
+        cursor.execute(f'DROP TABLE {LEGACY}')
+
+        # Índices en la tabla padre: se propagan a cada partición
+        cursor.execute(f'CREATE INDEX sensordata_dev_type_ts_idx ON {TABLE} (device_id, sensor_type, "timestamp" DESC)')
+        cursor.execute(f'CREATE INDEX sensordata_ts_brin ON {TABLE} USING brin ("timestamp")')
+
+
+def unpartition_sensor_data(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        # La tabla particionada (con sus particiones y su secuencia) pasa a LEGACY
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {LEGACY}')
+        cursor.execute(f'ALTER TABLE {LEGACY} RENAME CONSTRAINT {TABLE}_pkey TO {LEGACY}_pkey')
+        cursor.execute('DROP INDEX IF EXISTS sensordata_dev_type_ts_idx')
+        cursor.execute('DROP INDEX IF EXISTS sensordata_ts_brin')
+
+        cursor.execute(f'''
+            CREATE TABLE {TABLE} (
+                id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                "timestamp" timestamp with time zone NOT NULL,
+                data jsonb NOT NULL,
+                sensor_type varchar(50) NOT NULL,
+                device_id varchar(50) NOT NULL,
+                value double precision NULL,
+                unit varchar(8) NOT NULL,
+                CONSTRAINT sensordata_device_id_fk FOREIGN KEY (device_id)
+                    REFERENCES kittypaw_app_device (device_id) DEFERRABLE INITIALLY DEFERRED
+            )
+        ''')
+        cursor.execute(f'''
+            INSERT INTO {TABLE} (id, "timestamp", data, sensor_type, device_id, value, unit)
+            SELECT id, "timestamp", data, sensor_type, device_id, value, unit FROM {LEGACY}
+        ''')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+        )
+        cursor.execute(f'DROP TABLE {LEGACY} CASCADE')
+
+        cursor.execute(f'CREATE INDEX sensordata_dev_type_ts_idx ON {TABLE} (device_id, sensor_type, "timestamp" DESC)')
+        cursor.execute(f'CREATE INDEX sensordata_ts_brin ON {TABLE} USING brin ("timestamp")')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kittypaw_app', '0004_sensor_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_sensor_data, unpartition_sensor_data),
+    ]
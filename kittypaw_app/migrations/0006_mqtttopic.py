@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kittypaw_app', '0005_partition_sensordata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MqttTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255, unique=True)),
+                ('qos', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kittypaw_app', '0006_mqtttopic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLayerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
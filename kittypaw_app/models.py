@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.indexes import BrinIndex
 import json
 
 class UserManager(BaseUserManager):
@@ -40,18 +41,112 @@ class Device(models.Model):
     def __str__(self):
         return f"{self.name} ({self.device_id})"
 
+class SensorUnit(models.TextChoices):
+    CELSIUS = '°C', 'Grados Celsius'
+    PERCENT = '%', 'Porcentaje'
+    LUX = 'lux', 'Lux'
+    KILOGRAM = 'kg', 'Kilogramos'
+    NONE = '', 'Sin unidad'
+
+# Unidad de cada tipo de sensor del collar
+SENSOR_UNITS = {
+    'temperature': SensorUnit.CELSIUS,
+    'humidity': SensorUnit.PERCENT,
+    'light': SensorUnit.LUX,
+    'weight': SensorUnit.KILOGRAM,
+}
+
 class SensorData(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE, to_field='device_id', db_column='device_id')
     timestamp = models.DateTimeField(default=timezone.now)
     data = models.JSONField()
     sensor_type = models.CharField(max_length=50)
+    value = models.FloatField(blank=True, null=True)
+    unit = models.CharField(max_length=8, choices=SensorUnit.choices, blank=True, default=SensorUnit.NONE)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Consultas por dispositivo y tipo de sensor, más recientes primero
+            models.Index(fields=['device', 'sensor_type', '-timestamp'], name='sensordata_dev_type_ts_idx'),
+            # Filtros por rango de tiempo sobre toda la tabla
+            BrinIndex(fields=['timestamp'], name='sensordata_ts_brin'),
+        ]
     
     def __str__(self):
         return f"{self.device.name} - {self.sensor_type} - {self.timestamp}"
 
+class LatestSensorReading(models.Model):
+    """
+    Última lectura de cada dispositivo y tipo de sensor. La mantiene la ingesta
+    MQTT para no tener que ordenar SensorData al consultar el valor actual.
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, to_field='device_id', db_column='device_id', related_name='latest_readings')
+    sensor_type = models.CharField(max_length=50)
+    value = models.FloatField()
+    unit = models.CharField(max_length=20, blank=True, default='')
+    timestamp = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'sensor_type'], name='latest_reading_device_type_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.sensor_type}: {self.value} {self.unit}"
+
+class SensorRollup(models.Model):
+    """
+    Resumen de lecturas por dispositivo, tipo de sensor y bucket de tiempo.
+    Guarda suma y conteo (no el promedio) para poder acumular incrementalmente.
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, to_field='device_id', db_column='device_id', related_name='+')
+    sensor_type = models.CharField(max_length=50)
+    bucket = models.DateTimeField()
+    sample_count = models.BigIntegerField(default=0)
+    value_sum = models.FloatField(default=0)
+    value_min = models.FloatField(blank=True, null=True)
+    value_max = models.FloatField(blank=True, null=True)
+    
+    class Meta:
+        abstract = True
+    
+    def __str__(self):
+        return f"{self.device_id} - {self.sensor_type} - {self.bucket}"
+
+class SensorRollupMinute(SensorRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'sensor_type', 'bucket'], name='rollup_minute_uniq'),
+        ]
+
+class SensorRollupHour(SensorRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'sensor_type', 'bucket'], name='rollup_hour_uniq'),
+        ]
+
+class SensorRollupDay(SensorRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'sensor_type', 'bucket'], name='rollup_day_uniq'),
+        ]
+
+class RollupWatermark(models.Model):
+    """
+    Último id de SensorData ya incorporado a los rollups
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    # Máximo id visible en la ejecución anterior; se procesa hasta aquí para
+    # no saltar filas de transacciones que aún no habían confirmado
+    pending_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
 class MqttConnection(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     broker_url = models.CharField(max_length=255)
@@ -67,6 +162,26 @@ class MqttConnection(models.Model):
     def __str__(self):
         return f"{self.broker_url} - {self.client_id}"
 
+class MqttTopic(models.Model):
+    """
+    Tópico adicional a la suscripción comodín; se persiste para volver a
+    suscribirse tras un reinicio
+    """
+    topic = models.CharField(max_length=255, unique=True)
+    qos = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.topic
+
+class ChannelLayerMessage(models.Model):
+    """
+    Mensajes de PostgresChannelLayer que no caben en un NOTIFY; se notifica
+    solo su id y se eliminan al poco tiempo
+    """
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
 class PetOwner(models.Model):
     name = models.CharField(max_length=100)
     paternal_last_name = models.CharField(max_length=100)
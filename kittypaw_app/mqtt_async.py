@@ -0,0 +1,229 @@
+import asyncio
+import json
+import threading
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import paho.mqtt.client as mqtt
+from .mqtt_client import MqttClient
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMqttClient(MqttClient):
+    """
+    Motor MQTT que corre dentro del event loop del servidor ASGI.
+
+    El socket de paho se registra en el loop con add_reader/add_writer (sin
+    `loop_start()` ni hilo de red propio), la reconexión es una tarea asyncio
+    y los eventos para los WebSockets se envían al channel layer desde una
+    única tarea de difusión, sin un `async_to_sync` por mensaje. La escritura
+    en base de datos sigue en el hilo escritor de la ingesta.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self._loop_thread = None
+        self._events = None
+        self._fanout_task = None
+        self._misc_task = None
+        self._reconnect_task = None
+        self._started = False
+        self._closing = False
+        self.broadcast_dropped = 0
+
+    # --- Integración con el event loop ---
+
+    def _in_loop(self, callback, *args):
+        """
+        Ejecuta `callback` en el hilo del event loop
+        """
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self._in_loop(self._watch_socket, sock)
+
+    def _watch_socket(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        # Keepalive y reintentos de paho
+        while self.client and self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def create_client(self, client_id, username=None, password=None):
+        client = super().create_client(client_id, username, password)
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        return client
+
+    # --- Ciclo de vida ---
+
+    async def start(self):
+        """
+        Carga la última configuración guardada y conecta. Idempotente.
+        """
+        if self._started:
+            return
+        self._started = True
+        self._closing = False
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._events = asyncio.Queue(maxsize=getattr(settings, 'MQTT_BROADCAST_QUEUE_SIZE', 10000))
+        self._fanout_task = self.loop.create_task(self._fanout())
+
+        try:
+            await sync_to_async(self.load_topics)()
+            params = await sync_to_async(self.get_connection_params)()
+        except Exception as e:
+            logger.error(f"Error cargando configuración MQTT: {str(e)}")
+            return
+        await self.connect_async(**params)
+
+    async def connect_async(self, broker_url="mqtt://broker.emqx.io:1883", client_id="django_kittypaw", username=None, password=None, record=True):
+        broker_url, host, port = self.parse_broker_url(broker_url)
+
+        if self.client:
+            self.client.disconnect()
+
+        try:
+            self.client = self.create_client(client_id, username, password)
+            self.writer.start()
+
+            # La conexión TCP (y DNS) se resuelve fuera del loop; el socket se
+            # registra en el loop a través de on_socket_open
+            await self.loop.run_in_executor(None, self.client.connect, host, port, 60)
+
+            self.offline_detector.start()
+            if record:
+                await sync_to_async(self.record_connection)(broker_url, client_id, username, password)
+
+            logger.info(f"Conectado a broker MQTT (asyncio): {broker_url}")
+            return True
+        except Exception as e:
+            logger.error(f"Error al conectar a MQTT: {str(e)}")
+            return False
+
+    async def stop(self):
+        self._closing = True
+        for task in (self._reconnect_task, self._misc_task):
+            if task:
+                task.cancel()
+
+        if self.client:
+            self.client.disconnect()
+            # Dejar que el loop envíe el paquete DISCONNECT
+            await asyncio.sleep(0)
+            self.client = None
+
+        await sync_to_async(self.shutdown_workers)()
+
+        if self._fanout_task:
+            self._fanout_task.cancel()
+        self._started = False
+        logger.info("Desconectado del broker MQTT")
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        logger.warning(f"Desconectado del broker MQTT con código: {rc}")
+        if not self._closing:
+            self._in_loop(self._schedule_reconnect)
+
+    def _schedule_reconnect(self):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 5
+        while self.client and not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except OSError as e:
+                logger.error(f"Error reconectando a MQTT: {str(e)}")
+                delay = min(delay * 2, 60)
+
+    # --- API usada desde vistas síncronas (hilos de trabajo) ---
+
+    def connect(self, broker_url="mqtt://broker.emqx.io:1883", client_id="django_kittypaw", username=None, password=None):
+        if self.loop is None:
+            logger.error("El motor MQTT asyncio aún no está en ejecución")
+            return False
+        # Tópicos y registro en base de datos se resuelven en el hilo que llama:
+        # el loop no puede volver a este hilo mientras espera el resultado
+        self.load_topics()
+        future = asyncio.run_coroutine_threadsafe(
+            self.connect_async(broker_url, client_id, username, password, record=False), self.loop
+        )
+        if not future.result(timeout=30):
+            return False
+        self.record_connection(self.parse_broker_url(broker_url)[0], client_id, username, password)
+        return True
+
+    def disconnect(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.stop(), self.loop)
+
+    def subscribe_topic(self, topic, qos):
+        if self.loop is None:
+            return super().subscribe_topic(topic, qos)
+        self._in_loop(super().subscribe_topic, topic, qos)
+
+    def publish(self, topic, message):
+        if not self.is_connected():
+            logger.error("No se puede publicar: cliente MQTT no conectado")
+            return False
+
+        if isinstance(message, dict):
+            message = json.dumps(message)
+
+        self._in_loop(self.client.publish, topic, message)
+        return True
+
+    # --- Difusión a WebSockets ---
+
+    def broadcast_to_clients(self, data):
+        """
+        Encola el evento para la tarea de difusión; válido desde cualquier hilo
+        """
+        if self.loop is None:
+            return
+        self._in_loop(self._enqueue_event, data)
+
+    def _enqueue_event(self, data):
+        try:
+            self._events.put_nowait(data)
+        except asyncio.QueueFull:
+            self.broadcast_dropped += 1
+
+    async def _fanout(self):
+        from channels.layers import get_channel_layer
+        channel_layer = get_channel_layer()
+        while True:
+            data = await self._events.get()
+            try:
+                device_id = data.get('deviceId')
+                if device_id and self.devices.peek(device_id) is None:
+                    # Completa la caché fuera del event loop antes de elegir los grupos
+                    await sync_to_async(self.devices.get)(device_id)
+                for group, message in self.group_messages(data, resolve=False):
+                    await channel_layer.group_send(group, message)
+            except Exception as e:
+                logger.error(f"Error transmitiendo datos a clientes WebSocket: {str(e)}")
@@ -1,10 +1,16 @@
 import json
+import zlib
 import threading
-import time
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 import paho.mqtt.client as mqtt
-from .models import Device, SensorData, MqttConnection
+from .models import Device, MqttConnection, MqttTopic
+from .ingestion import DeviceStateBuffer, SensorDataWriter
+from .payloads import PayloadError, decode_message, dumps
+from .device_cache import DeviceRegistry
+from .offline import OfflineDetector
+from .groups import groups_for_device
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,54 +18,161 @@ logger = logging.getLogger(__name__)
 class MqttClient:
     def __init__(self):
         self.client = None
-        self.topics = set(['KPCL0021/pub', 'KPCL0022/pub'])
+        # tópico -> QoS; se completa con load_topics() antes de conectar
+        self.wildcard_topic = getattr(settings, 'MQTT_WILDCARD_TOPIC', '+/pub')
+        self.topics = {self.wildcard_topic: 0} if self.wildcard_topic else {}
         self.connection_id = None
         self.reconnect_timer = None
         self.web_sockets = set()
-        self.device_last_seen = {}
-        self.offline_check_timer = None
-        self.DEVICE_TIMEOUT_MS = 15000  # 15 segundos sin datos = dispositivo offline
+        # Vencimientos por dispositivo; al vencer se marca offline
+        self.offline_detector = OfflineDetector(on_expired=self.mark_offline)
+        # Caché de dispositivos: evita leer Device en cada mensaje
+        self.devices = DeviceRegistry()
+        # Cambios de estado/batería pendientes de escribir (write-behind)
+        self.device_state = DeviceStateBuffer(self.devices)
+        # Escritor en segundo plano: on_message solo decodifica y encola
+        self.writer = SensorDataWriter(
+            registry=self.devices,
+            device_state=self.device_state,
+            device_state_handler=self.apply_device_state
+        )
+        # Reparto de la ingesta entre procesos (ver `manage.py run_ingest`)
+        self.shard_mode = None
+        self.shard_index = 0
+        self.shard_count = 1
+        self.share_group = 'kittypaw'
+    
+    def configure_shard(self, index, count, mode='share', group='kittypaw'):
+        """
+        Limita este proceso a su parte de la ingesta.
         
-    def connect(self, broker_url="mqtt://broker.emqx.io:1883", client_id="django_kittypaw", username=None, password=None):
+        'share': suscripción compartida MQTT v5 ($share/<grupo>/+/pub); el broker
+        reparte los mensajes entre los procesos del grupo.
+        'hash': cada proceso se suscribe solo a los tópicos cuyo crc32 módulo
+        `count` es igual a `index`. Requiere tópicos por dispositivo
+        (MQTT_WILDCARD_TOPIC vacío): con un comodín todos los workers recibirían
+        todo el tráfico.
+        """
+        if mode not in ('share', 'hash'):
+            raise ValueError(f"Modo de reparto no soportado: {mode}")
+        if mode == 'hash' and self.wildcard_topic:
+            raise ValueError(
+                f"El modo 'hash' no reparte el comodín {self.wildcard_topic}; "
+                "use el modo 'share' o deje MQTT_WILDCARD_TOPIC vacío"
+            )
+        self.shard_mode = mode
+        self.shard_index = index
+        self.shard_count = count
+        self.share_group = group
+    
+    def owns_topic(self, topic):
+        if self.shard_mode != 'hash':
+            return True
+        return zlib.crc32(topic.encode('utf-8')) % self.shard_count == self.shard_index
+    
+    def subscription_for(self, topic):
+        """
+        Filtro con el que este proceso se suscribe a `topic`, o None si el
+        tópico corresponde a otro worker
+        """
+        if self.shard_mode == 'share':
+            return f"$share/{self.share_group}/{topic}"
+        # En modo hash cada filtro, concreto o con comodín, lo atiende un solo worker
+        if self.owns_topic(topic):
+            return topic
+        return None
+    
+    def subscription_topics(self):
+        subscriptions = []
+        for topic, qos in list(self.topics.items()):
+            subscription = self.subscription_for(topic)
+            if subscription:
+                subscriptions.append((subscription, qos))
+        return subscriptions
+    
+    def load_topics(self):
+        """
+        Reconstruye la lista de suscripciones: el comodín (o, sin él, un
+        tópico por dispositivo registrado) más los tópicos persistidos
+        """
+        topics = {}
+        if self.wildcard_topic:
+            topics[self.wildcard_topic] = 0
+        else:
+            for device_id in Device.objects.values_list('device_id', flat=True):
+                topics[f"{device_id}/pub"] = 0
+        for topic, qos in MqttTopic.objects.values_list('topic', 'qos'):
+            if not self.covered_by_wildcard(topic):
+                topics[topic] = qos
+        self.topics = topics
+    
+    def covered_by_wildcard(self, topic):
+        return bool(self.wildcard_topic) and mqtt.topic_matches_sub(self.wildcard_topic, topic)
+    
+    @staticmethod
+    def device_id_from_topic(topic):
+        # Tópicos con la forma <device_id>/pub
+        parts = topic.split('/')
+        if len(parts) == 2 and parts[1] == 'pub':
+            return parts[0]
+        return None
+        
+    def parse_broker_url(self, broker_url):
         # Limpiar URL si viene con formato mqtt://
         if broker_url.startswith("mqtt://"):
             broker_url = broker_url[7:]
         
         host, port = broker_url.split(":")
+        return broker_url, host, int(port)
+    
+    def create_client(self, client_id, username=None, password=None):
+        # Crear un nuevo cliente MQTT; las suscripciones compartidas requieren MQTT v5
+        protocol = mqtt.MQTTv5 if self.shard_mode == 'share' else mqtt.MQTTv311
+        client = mqtt.Client(client_id=client_id, protocol=protocol)
+        
+        # Configurar credenciales si se proporcionan
+        if username and password:
+            client.username_pw_set(username, password)
+        
+        # Configurar callbacks
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        client.on_disconnect = self.on_disconnect
+        return client
+    
+    def record_connection(self, broker_url, client_id, username=None, password=None):
+        # Actualizar la base de datos
+        with transaction.atomic():
+            connection = MqttConnection.objects.create(
+                broker_url=broker_url,
+                client_id=client_id,
+                username=username,
+                password=password,
+                connected=True,
+                last_connected=timezone.now()
+            )
+            self.connection_id = connection.id
+    
+    def connect(self, broker_url="mqtt://broker.emqx.io:1883", client_id="django_kittypaw", username=None, password=None):
+        broker_url, host, port = self.parse_broker_url(broker_url)
         
         try:
-            # Crear un nuevo cliente MQTT
-            self.client = mqtt.Client(client_id=client_id)
-            
-            # Configurar credenciales si se proporcionan
-            if username and password:
-                self.client.username_pw_set(username, password)
-            
-            # Configurar callbacks
-            self.client.on_connect = self.on_connect
-            self.client.on_message = self.on_message
-            self.client.on_disconnect = self.on_disconnect
+            self.load_topics()
+            self.client = self.create_client(client_id, username, password)
             
             # Conectar al broker
-            self.client.connect(host, int(port), 60)
+            self.client.connect(host, port, 60)
+            
+            # Iniciar el escritor de ingesta antes de recibir mensajes
+            self.writer.start()
             
             # Iniciar el loop en un hilo separado
             self.client.loop_start()
             
-            # Iniciar el temporizador de verificación de dispositivos offline
-            self.start_offline_check_timer()
+            # Iniciar la detección de dispositivos offline
+            self.offline_detector.start()
             
-            # Actualizar la base de datos
-            with transaction.atomic():
-                connection = MqttConnection.objects.create(
-                    broker_url=broker_url,
-                    client_id=client_id,
-                    username=username,
-                    password=password,
-                    connected=True,
-                    last_connected=timezone.now()
-                )
-                self.connection_id = connection.id
+            self.record_connection(broker_url, client_id, username, password)
             
             logger.info(f"Conectado a broker MQTT: {broker_url}")
             return True
@@ -73,24 +186,33 @@ class MqttClient:
             self.client.loop_stop()
             self.client.disconnect()
             self.client = None
-            
-            # Actualizar la base de datos
-            if self.connection_id:
-                try:
-                    connection = MqttConnection.objects.get(id=self.connection_id)
-                    connection.connected = False
-                    connection.save()
-                except MqttConnection.DoesNotExist:
-                    pass
-                
+            self.shutdown_workers()
             logger.info("Desconectado del broker MQTT")
     
-    def on_connect(self, client, userdata, flags, rc):
+    def shutdown_workers(self):
+        """
+        Detiene los hilos auxiliares y marca la conexión como cerrada
+        """
+        self.offline_detector.stop()
+        
+        # Persistir las lecturas pendientes antes de cerrar
+        self.writer.stop()
+        
+        # Actualizar la base de datos
+        if self.connection_id:
+            try:
+                connection = MqttConnection.objects.get(id=self.connection_id)
+                connection.connected = False
+                connection.save()
+            except MqttConnection.DoesNotExist:
+                pass
+    
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         logger.info("Conectado al broker MQTT")
         # Suscribirse a todos los tópicos
         self.subscribe()
     
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         logger.warning(f"Desconectado del broker MQTT con código: {rc}")
         # Intenta reconectar después de un tiempo
         if self.reconnect_timer:
@@ -100,132 +222,102 @@ class MqttClient:
         self.reconnect_timer.start()
     
     def subscribe(self):
-        for topic in self.topics:
-            self.client.subscribe(topic)
-            logger.info(f"Suscrito al tópico: {topic}")
+        # Un único SUBSCRIBE con todos los filtros
+        subscriptions = self.subscription_topics()
+        if not subscriptions:
+            return
+        self.client.subscribe(subscriptions)
+        logger.info(f"Suscrito a {len(subscriptions)} tópicos: {', '.join(topic for topic, _ in subscriptions[:10])}")
     
-    def add_topic(self, topic):
+    def add_topic(self, topic, persist=False):
+        """
+        Se suscribe a `topic` en este proceso. Con `persist` se guarda como
+        MqttTopic y todos los procesos de ingesta lo cargan al conectar; solo
+        deben persistir las rutas de administración, nunca los WebSockets.
+        """
         # Formatear el tópico si es necesario
         if not topic.endswith('/pub'):
             topic = f"{topic}/pub"
             logger.info(f"Formateando tópico como {topic} para asegurar el formato correcto")
         
-        if topic not in self.topics:
-            self.topics.add(topic)
-            if self.client and self.client.is_connected():
-                self.client.subscribe(topic)
-                logger.info(f"Añadido nuevo tópico: {topic}")
-    
-    def start_offline_check_timer(self):
-        def check_offline_devices():
-            while self.client and self.client.is_connected():
-                current_time = time.time() * 1000
-                for device_id, last_seen in list(self.device_last_seen.items()):
-                    if current_time - last_seen > self.DEVICE_TIMEOUT_MS:
-                        self.update_device_status(device_id, "offline")
-                time.sleep(5)  # Verificar cada 5 segundos
+        if self.covered_by_wildcard(topic):
+            return
         
-        self.offline_check_timer = threading.Thread(target=check_offline_devices, daemon=True)
-        self.offline_check_timer.start()
-        logger.info("Iniciado temporizador de detección de dispositivos offline")
+        if persist:
+            # Sobrevive a reinicios y reconexiones
+            MqttTopic.objects.get_or_create(topic=topic)
+        if topic in self.topics:
+            return
+        self.topics[topic] = 0
+        self.subscribe_topic(topic, 0)
+    
+    def subscribe_topic(self, topic, qos):
+        subscription = self.subscription_for(topic)
+        if subscription and self.client and self.client.is_connected():
+            self.client.subscribe(subscription, qos)
+            logger.info(f"Añadido nuevo tópico: {topic}")
+    
+    def mark_offline(self, device_id):
+        self.update_device_status(device_id, "offline")
     
     def update_device_status(self, device_id, status):
+        # El cambio queda en memoria y el escritor lo persiste en lote
+        if not self.device_state.set_status(device_id, status):
+            return
+        
+        logger.info(f"Actualizado estado del dispositivo {device_id} a {status}")
+        
+        # Enviar notificación a los clientes websocket
+        self.broadcast_to_clients({
+            'type': 'deviceStatus',
+            'deviceId': device_id,
+            'status': status
+        })
+    
+    def apply_device_state(self, device_id, status, battery):
+        """
+        Aplica el último estado y nivel de batería recibidos de un dispositivo.
+        Se ejecuta en el hilo escritor, nunca en el hilo de red de paho.
+        """
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        
+        # Reprogramar su vencimiento según el timeout de su tipo
+        self.offline_detector.touch(device_id, device.type)
+        
+        self.update_device_status(device_id, status)
+        if battery is not None:
+            self.device_state.set_battery(device_id, battery)
+    
+    def on_message(self, client, userdata, msg):
+        # Descartar collares no registrados antes de decodificar el mensaje
+        topic_device_id = self.device_id_from_topic(msg.topic)
+        if topic_device_id is not None and not self.devices.allows(topic_device_id):
+            return
+        
         try:
-            device = Device.objects.get(device_id=device_id)
-            if device.status != status:
-                device.status = status
-                device.last_update = timezone.now()
-                device.save()
-                logger.info(f"Actualizado estado del dispositivo {device_id} a {status}")
+            for item, frame in decode_message(msg.payload, topic_device_id):
+                if not self.devices.allows(item.device_id):
+                    continue
                 
-                # Enviar notificación a los clientes websocket
+                # La persistencia (lecturas, estado y batería) la realiza el escritor en lote
+                self.writer.submit(item)
+                
+                # Transmitir a clientes websocket la trama ya serializada
                 self.broadcast_to_clients({
-                    'type': 'deviceStatus',
-                    'deviceId': device_id,
-                    'status': status
+                    'type': 'sensorData',
+                    'deviceId': item.device_id,
+                    'frame': frame,
+                    'timestamp': item.timestamp.isoformat(),
+                    'readings': [[sensor_type, value] for sensor_type, value, _ in item.readings]
                 })
-            else:
-                logger.warning(f"No se actualizó el estado de {device_id} de {device.status} a {status}. Estado actual: {device.status}")
-        except Device.DoesNotExist:
-            logger.warning(f"Dispositivo no encontrado: {device_id}")
-    
-    def on_message(self, client, userdata, msg):
-        try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            device_id = payload.get('device_id')
-            
-            if not device_id:
-                logger.warning(f"Mensaje sin device_id: {payload}")
-                return
-            
-            # Actualizar última vez visto
-            self.device_last_seen[device_id] = time.time() * 1000
-            
-            # Actualizar estado del dispositivo (si es diferente)
-            status = payload.get('status', 'online')
-            self.update_device_status(device_id, status)
-            
-            # Actualizar nivel de batería si existe
-            if 'battery' in payload:
-                try:
-                    device = Device.objects.get(device_id=device_id)
-                    device.battery_level = int(payload['battery'])
-                    device.save()
-                except (Device.DoesNotExist, ValueError):
-                    pass
-            
-            # Guardar datos de sensores
-            timestamp = timezone.now()
-            if 'timestamp' in payload:
-                try:
-                    # Convertir timestamp del formato "DD/MM/YYYY, HH:MM:SS"
-                    timestamp = timezone.datetime.strptime(
-                        payload['timestamp'], 
-                        "%d/%m/%Y, %H:%M:%S"
-                    )
-                except ValueError:
-                    pass
-            
-            # Crear registros para cada tipo de sensor
-            sensor_types = ['temperature', 'humidity', 'light', 'weight']
-            for sensor_type in sensor_types:
-                if sensor_type in payload:
-                    try:
-                        device = Device.objects.get(device_id=device_id)
-                        SensorData.objects.create(
-                            device=device,
-                            timestamp=timestamp,
-                            sensor_type=sensor_type,
-                            data=json.dumps({
-                                'value': float(payload[sensor_type]),
-                                'unit': self.get_unit_for_sensor(sensor_type),
-                                'timestamp': timestamp.isoformat()
-                            })
-                        )
-                    except (Device.DoesNotExist, ValueError) as e:
-                        logger.error(f"Error al guardar datos de sensor {sensor_type}: {str(e)}")
-            
-            # Transmitir a clientes websocket
-            self.broadcast_to_clients({
-                'type': 'sensorData',
-                'deviceId': device_id,
-                'data': payload
-            })
                 
-        except json.JSONDecodeError:
-            logger.error(f"Error decodificando mensaje MQTT: {msg.payload}")
+        except PayloadError as e:
+            logger.error(f"Error decodificando mensaje MQTT de {msg.topic}: {str(e)}")
         except Exception as e:
             logger.error(f"Error procesando mensaje MQTT: {str(e)}")
     
-    def get_unit_for_sensor(self, sensor_type):
-        units = {
-            'temperature': '°C',
-            'humidity': '%',
-            'light': 'lux',
-            'weight': 'kg'
-        }
-        return units.get(sensor_type, '')
-    
     def is_connected(self):
         return self.client and self.client.is_connected()
     
@@ -240,6 +332,46 @@ class MqttClient:
         result = self.client.publish(topic, message)
         return result.rc == mqtt.MQTT_ERR_SUCCESS
     
+    def group_messages(self, data, resolve=True):
+        """
+        Traduce un evento a los mensajes de grupo del channel layer. Con
+        `resolve` un dispositivo que no está en caché se consulta en la base
+        de datos para no perder el grupo de su propietario; el motor asyncio
+        lo resuelve antes fuera del event loop y pasa resolve=False.
+        """
+        message_type = data.get('type')
+        
+        # La trama se serializa una vez aquí y los consumidores la envían tal cual
+        if message_type == 'sensorData':
+            message = {
+                'type': 'send_sensor_data',
+                'text': data['frame'],
+                # Valores sueltos para las conexiones que agrupan actualizaciones
+                'deviceId': data.get('deviceId'),
+                'timestamp': data.get('timestamp'),
+                'readings': data.get('readings', [])
+            }
+        elif message_type == 'deviceStatus':
+            message = {
+                'type': 'send_device_status',
+                'text': dumps({
+                    'type': 'deviceStatus',
+                    'deviceId': data.get('deviceId'),
+                    'status': data.get('status')
+                })
+            }
+        else:
+            return []
+        
+        # Solo a los interesados: grupo del dispositivo, de su propietario y de administradores
+        device_id = data.get('deviceId')
+        device = self.devices.peek(device_id)
+        if device is None and resolve and device_id:
+            # No está en caché o se acaba de invalidar (cambio de dueño)
+            device = self.devices.get(device_id)
+        owner_id = device.owner_id if device is not None else None
+        return [(group, message) for group in groups_for_device(device_id, owner_id)]
+    
     def broadcast_to_clients(self, data):
         """
         Transmite datos a todos los clientes WebSocket
@@ -250,45 +382,41 @@ class MqttClient:
             from asgiref.sync import async_to_sync
             
             channel_layer = get_channel_layer()
-            message_type = data.get('type')
-            
-            if message_type == 'sensorData':
-                async_to_sync(channel_layer.group_send)(
-                    'sensor_data_group',
-                    {
-                        'type': 'send_sensor_data',
-                        'data': data.get('data', {})
-                    }
-                )
-            elif message_type == 'deviceStatus':
-                async_to_sync(channel_layer.group_send)(
-                    'sensor_data_group',
-                    {
-                        'type': 'send_device_status',
-                        'deviceId': data.get('deviceId'),
-                        'status': data.get('status')
-                    }
-                )
+            for group, message in self.group_messages(data):
+                async_to_sync(channel_layer.group_send)(group, message)
         except Exception as e:
             logger.error(f"Error transmitiendo datos a clientes WebSocket: {str(e)}")
     
+    def get_connection_params(self):
+        # Buscar la última conexión activa
+        connection = MqttConnection.objects.filter(connected=True).order_by('-last_connected').first()
+        if connection:
+            return {
+                'broker_url': connection.broker_url,
+                'client_id': connection.client_id,
+                'username': connection.username,
+                'password': connection.password
+            }
+        # Conectar al broker público por defecto
+        return {'broker_url': "mqtt://broker.emqx.io:1883"}
+    
     def load_and_connect(self):
         try:
-            # Buscar la última conexión activa
-            connection = MqttConnection.objects.filter(connected=True).order_by('-last_connected').first()
-            if connection:
-                return self.connect(
-                    broker_url=connection.broker_url,
-                    client_id=connection.client_id,
-                    username=connection.username,
-                    password=connection.password
-                )
-            else:
-                # Conectar al broker público por defecto
-                return self.connect(broker_url="mqtt://broker.emqx.io:1883")
+            return self.connect(**self.get_connection_params())
         except Exception as e:
             logger.error(f"Error cargando configuración MQTT: {str(e)}")
             return False
 
+def create_mqtt_client():
+    """
+    Crea el cliente según settings.MQTT_ENGINE: 'thread' usa el loop de paho
+    en un hilo propio; 'asyncio' corre dentro del event loop del servidor ASGI;
+    'external' deja la ingesta a `manage.py run_ingest` y el proceso web no conecta
+    """
+    if getattr(settings, 'MQTT_ENGINE', 'external') == 'asyncio':
+        from .mqtt_async import AsyncMqttClient
+        return AsyncMqttClient()
+    return MqttClient()
+
 # Instancia global del cliente MQTT
-mqtt_client = MqttClient()
\ No newline at end of file
+mqtt_client = create_mqtt_client()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import heapq
+import threading
+import time
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineDetector:
+    """
+    Detección de dispositivos sin datos basada en vencimientos.
+
+    Cada dispositivo tiene un único vencimiento vigente (último visto más el
+    timeout de su tipo) y a lo sumo una entrada en un min-heap. El hilo
+    detector duerme hasta el vencimiento más próximo y solo procesa los
+    dispositivos cuyo plazo realmente pasó; al reportarlos offline deja de
+    seguirlos hasta que vuelvan a enviar datos.
+    """
+
+    def __init__(self, on_expired, timeouts_ms=None):
+        self.on_expired = on_expired
+        self.timeouts_ms = timeouts_ms or getattr(settings, 'DEVICE_TIMEOUTS_MS', {'default': 15000})
+        self._heap = []
+        self._deadlines = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.expired_count = 0
+
+    def timeout_for(self, device_type):
+        timeout_ms = self.timeouts_ms.get(device_type, self.timeouts_ms.get('default', 15000))
+        return timeout_ms / 1000
+
+    def touch(self, device_id, device_type=None):
+        """
+        Registra que el dispositivo envió datos ahora
+        """
+        deadline = time.monotonic() + self.timeout_for(device_type)
+        with self._cond:
+            tracked = device_id in self._deadlines
+            self._deadlines[device_id] = deadline
+            # Si ya tiene entrada en el heap se reprograma al llegar a la cima
+            if not tracked:
+                heapq.heappush(self._heap, (deadline, device_id))
+                if self._heap[0][1] == device_id:
+                    self._cond.notify()
+
+    def tracked(self):
+        return len(self._deadlines)
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='kittypaw-offline', daemon=True)
+            self._thread.start()
+        logger.info("Iniciado detector de dispositivos offline")
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _pop_expired(self, now):
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, device_id = heapq.heappop(self._heap)
+            deadline = self._deadlines.get(device_id)
+            if deadline is None:
+                continue
+            if deadline > now:
+                # Llegaron datos después de programar esta entrada
+                heapq.heappush(self._heap, (deadline, device_id))
+                continue
+            del self._deadlines[device_id]
+            expired.append(device_id)
+        return expired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                expired = self._pop_expired(time.monotonic())
+                if not expired:
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout=timeout)
+                    continue
+
+            for device_id in expired:
+                self.expired_count += 1
+                try:
+                    self.on_expired(device_id)
+                except Exception as e:
+                    logger.error(f"Error marcando {device_id} como offline: {str(e)}")
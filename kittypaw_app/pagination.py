@@ -0,0 +1,81 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Paginación por cursor sobre `id` para los ViewSets: cada página es una
+    búsqueda por índice, sin OFFSET, y el tamaño queda acotado en el servidor.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class SensorDataCursorPagination(BasePagination):
+    """
+    Paginación por cursor sobre (timestamp, id), de la lectura más reciente a
+    la más antigua. `?limit=` sigue sirviendo como tamaño de página.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = 'Cursor inválido'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, reading):
+        raw = f"{reading.timestamp.isoformat()}|{reading.pk}"
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            timestamp, pk = raw.rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError
+            return timestamp, int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-timestamp', '-id')
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            timestamp, pk = self.decode_cursor(encoded)
+            queryset = queryset.filter(timestamp__lte=timestamp).filter(
+                Q(timestamp__lt=timestamp) | Q(id__lt=pk)
+            )
+
+        # Se pide una fila extra para saber si existe una página siguiente
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = self.encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
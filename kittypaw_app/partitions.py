@@ -0,0 +1,125 @@
+import logging
+from datetime import date
+from django.db import connection, transaction
+from .models import SensorData
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = SensorData._meta.db_table
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_p{month.year}_{month.month:02d}"
+
+
+def list_partitions():
+    """
+    Devuelve {mes: nombre} de las particiones mensuales existentes
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, [PARENT_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    prefix = f"{PARENT_TABLE}_p"
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            year, month = name[len(prefix):].split('_')
+            partitions[date(int(year), int(month), 1)] = name
+        except ValueError:
+            continue
+    return partitions
+
+
+def create_partition(month):
+    """
+    Crea la partición de `month`. Si la partición por defecto ya recibió
+    filas de ese mes (relojes de collar adelantados, o meses sin ejecutar
+    `sensordata_partitions`), PostgreSQL rechaza el CREATE ... PARTITION OF:
+    la partición por defecto se separa, sus filas del mes se mueven a la
+    nueva partición y se vuelve a adjuntar, todo en una transacción.
+    """
+    name = partition_name(month)
+    following = add_months(month, 1)
+    parent = connection.ops.quote_name(PARENT_TABLE)
+    quoted = connection.ops.quote_name(name)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [DEFAULT_PARTITION])
+        stranded = False
+        if cursor.fetchone()[0]:
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s)',
+                [month, following]
+            )
+            stranded = cursor.fetchone()[0]
+
+        if stranded:
+            cursor.execute(f'ALTER TABLE {parent} DETACH PARTITION {default}')
+        cursor.execute(
+            f'CREATE TABLE {quoted} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)',
+            [month, following]
+        )
+        if stranded:
+            cursor.execute(f'''
+                WITH moved AS (
+                    DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *
+                )
+                INSERT INTO {quoted} SELECT * FROM moved
+            ''', [month, following])
+            logger.warning(f"{cursor.rowcount} lecturas movidas de {DEFAULT_PARTITION} a {name}")
+            cursor.execute(f'ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT')
+    logger.info(f"Partición creada: {name}")
+    return name
+
+
+def create_future_partitions(months_ahead, today=None):
+    """
+    Crea las particiones del mes actual y de los `months_ahead` siguientes
+    """
+    current = month_start(today or date.today())
+    existing = list_partitions()
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            created.append(create_partition(month))
+    return created
+
+
+def drop_expired_partitions(retention_months, today=None, dry_run=False):
+    """
+    Separa y elimina las particiones cuyo mes completo quedó fuera de la retención
+    """
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    dropped = []
+    for month, name in sorted(list_partitions().items()):
+        if add_months(month, 1) > cutoff:
+            continue
+        if not dry_run:
+            quoted = connection.ops.quote_name(name)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(PARENT_TABLE)} DETACH PARTITION {quoted}')
+                cursor.execute(f'DROP TABLE {quoted}')
+            logger.info(f"Partición eliminada por retención: {name}")
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,298 @@
+"""
+Decodificación de los mensajes que publican los collares.
+
+Usa orjson cuando está instalado (`pip install .[fast]`) y la librería
+estándar en caso contrario. Un mensaje se decodifica una sola vez en un
+IngestItem que consume el escritor, y el texto recibido se reutiliza tal
+cual dentro de la trama que se difunde a los WebSockets.
+
+Los collares también pueden publicar MessagePack con claves cortas y varias
+muestras por paquete (`pip install .[binary]`); el formato se detecta por
+el primer byte.
+"""
+import json
+import logging
+import math
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+from django.utils import timezone
+from .ingestion import IngestItem
+from .models import SensorUnit, SENSOR_UNITS
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependencia opcional
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+SENSOR_TYPES = ('temperature', 'humidity', 'light', 'weight')
+
+# Formato de fecha de los collares: "DD/MM/YYYY, HH:MM:SS"
+TIMESTAMP_FORMAT = "%d/%m/%Y, %H:%M:%S"
+
+
+class PayloadError(ValueError):
+    """
+    Mensaje que no se puede interpretar como lectura de un collar
+    """
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+else:
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+
+@lru_cache(maxsize=4096)
+def parse_collar_timestamp(raw):
+    """
+    Convierte la fecha del collar en datetime con zona horaria. Los collares
+    publican varias lecturas por segundo con la misma fecha, así que el
+    resultado se memoriza.
+    """
+    try:
+        return timezone.make_aware(datetime.strptime(raw, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_device_id(device_id, topic_device_id):
+    device_id = device_id or topic_device_id
+    if not device_id:
+        raise PayloadError("Mensaje sin device_id")
+    if topic_device_id is not None and device_id != topic_device_id:
+        raise PayloadError(f"device_id {device_id} no coincide con el tópico de {topic_device_id}")
+    return device_id
+
+
+def _parse_battery(battery):
+    if battery is None:
+        return None
+    try:
+        return int(battery)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_readings(sample, keys):
+    """
+    Extrae las lecturas de `sample`; `keys` relaciona la clave usada en el
+    mensaje con el tipo de sensor
+    """
+    readings = []
+    for key, sensor_type in keys:
+        raw_value = sample.get(key)
+        if raw_value is None:
+            continue
+        try:
+            value = float(raw_value)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Error al leer dato de sensor {sensor_type}: {str(e)}")
+            continue
+        # "NaN", "inf" o "1e999" se convierten sin error, pero envenenarían
+        # los rollups y no son JSON válido en las tramas
+        if not math.isfinite(value):
+            logger.error(f"Valor no finito descartado para el sensor {sensor_type}: {raw_value!r}")
+            continue
+        readings.append((sensor_type, value, SENSOR_UNITS.get(sensor_type, SensorUnit.NONE)))
+    return readings
+
+
+JSON_KEYS = tuple((sensor_type, sensor_type) for sensor_type in SENSOR_TYPES)
+
+
+def decode_collar_message(text, topic_device_id=None):
+    """
+    Interpreta el JSON de un collar en una sola pasada y devuelve un
+    IngestItem. `topic_device_id` se usa cuando el mensaje no trae device_id.
+    """
+    return _decode_json(text, topic_device_id)[0]
+
+
+def _decode_json(text, topic_device_id):
+    """
+    Devuelve (IngestItem, completo); `completo` es False si se descartó
+    algún valor de sensor presente en el mensaje
+    """
+    try:
+        payload = loads(text)
+    except ValueError as e:
+        raise PayloadError(f"JSON inválido: {str(e)}")
+    if not isinstance(payload, dict):
+        raise PayloadError("Se esperaba un objeto JSON")
+
+    device_id = _resolve_device_id(payload.get('device_id'), topic_device_id)
+
+    timestamp = None
+    if 'timestamp' in payload:
+        timestamp = parse_collar_timestamp(payload['timestamp'])
+
+    readings = _parse_readings(payload, JSON_KEYS)
+    present = sum(1 for key, _ in JSON_KEYS if payload.get(key) is not None)
+    item = IngestItem(
+        device_id,
+        payload.get('status', 'online'),
+        _parse_battery(payload.get('battery')),
+        timestamp or timezone.now(),
+        readings
+    )
+    return item, len(readings) == present
+
+
+def sensor_data_frame(device_id, text):
+    """
+    Trama WebSocket de una lectura: el JSON del collar se inserta sin volver
+    a serializarlo
+    """
+    return '{"type":"sensorData","deviceId":' + dumps(device_id) + ',"data":' + text + '}'
+
+
+# --- Formato binario (MessagePack) ---
+#
+# Mapa con claves cortas y una o más muestras por paquete:
+#   {"d": "KPCL0021", "s": "online", "b": 87,
+#    "r": [{"t": 1760000000, "T": 21.5, "H": 40.0, "L": 300, "W": 4.2}, ...]}
+# "d" es opcional si el tópico ya identifica al collar; "t" son segundos
+# Unix (o el formato de fecha del collar) y, si falta, se usa la hora de llegada.
+
+BINARY_KEYS = (
+    ('T', 'temperature'),
+    ('H', 'humidity'),
+    ('L', 'light'),
+    ('W', 'weight'),
+)
+
+# Límite de muestras por paquete para acotar el trabajo por mensaje
+MAX_SAMPLES_PER_PACKET = 100
+
+
+def is_msgpack(raw):
+    """
+    Un mensaje MessagePack de collar empieza con un mapa (fixmap, map16 o
+    map32); un JSON empieza con '{' o espacios, que nunca caen en ese rango
+    """
+    if not raw:
+        return False
+    first = raw[0]
+    return 0x80 <= first <= 0x8f or first in (0xde, 0xdf)
+
+
+def _sample_timestamp(raw):
+    if isinstance(raw, (int, float)):
+        try:
+            return datetime.fromtimestamp(raw, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if isinstance(raw, str):
+        return parse_collar_timestamp(raw)
+    return None
+
+
+def decode_binary_message(raw, topic_device_id=None):
+    """
+    Decodifica un paquete MessagePack y devuelve un IngestItem por muestra
+    """
+    if msgpack is None:
+        raise PayloadError("Mensaje MessagePack recibido pero el paquete 'msgpack' no está instalado")
+    try:
+        payload = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise PayloadError(f"MessagePack inválido: {str(e)}")
+    if not isinstance(payload, dict):
+        raise PayloadError("Se esperaba un mapa MessagePack")
+
+    device_id = _resolve_device_id(payload.get('d'), topic_device_id)
+    status = payload.get('s', 'online')
+    battery = _parse_battery(payload.get('b'))
+
+    samples = payload.get('r')
+    if samples is None:
+        # Paquete de una sola muestra con las lecturas en el nivel superior
+        samples = [payload]
+    if not isinstance(samples, list) or len(samples) > MAX_SAMPLES_PER_PACKET:
+        raise PayloadError(f"'r' debe ser una lista de hasta {MAX_SAMPLES_PER_PACKET} muestras")
+
+    now = timezone.now()
+    items = []
+    for sample in samples:
+        if not isinstance(sample, dict):
+            raise PayloadError("Cada muestra debe ser un mapa")
+        items.append(IngestItem(
+            device_id,
+            status,
+            battery,
+            _sample_timestamp(sample.get('t')) or now,
+            _parse_readings(sample, BINARY_KEYS)
+        ))
+    return items
+
+
+def item_frame(item):
+    """
+    Trama WebSocket con la forma del JSON de los collares, para mensajes
+    que no llegaron como JSON
+    """
+    data = {'device_id': item.device_id, 'status': item.status, 'timestamp': item.timestamp.isoformat()}
+    if item.battery is not None:
+        data['battery'] = item.battery
+    for sensor_type, value, _ in item.readings:
+        data[sensor_type] = value
+    return dumps({'type': 'sensorData', 'deviceId': item.device_id, 'data': data})
+
+
+def decode_message(raw, topic_device_id=None):
+    """
+    Detecta el formato del mensaje y devuelve una lista de pares
+    (IngestItem, trama WebSocket)
+    """
+    if is_msgpack(raw):
+        return [(item, item_frame(item)) for item in decode_binary_message(raw, topic_device_id)]
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise PayloadError(f"Mensaje no es UTF-8: {str(e)}")
+    item, complete = _decode_json(text, topic_device_id)
+    # Con valores descartados el texto original no se reenvía a los navegadores
+    frame = sensor_data_frame(item.device_id, text) if complete else item_frame(item)
+    return [(item, frame)]
+
+
+# --- Tramas WebSocket binarias ---
+
+def pack(obj):
+    """
+    Serializa un objeto para un cliente WebSocket con encoding=msgpack
+    """
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+# Tramas de mayor tamaño (instantáneas, lotes) no se memorizan
+MAX_CACHED_FRAME = 4096
+
+
+def frame_to_msgpack(text):
+    """
+    Convierte una trama JSON ya serializada a MessagePack. Todas las
+    conexiones reciben el mismo texto, así que la conversión de las tramas
+    de lectura se hace una vez por trama y proceso.
+    """
+    if len(text) > MAX_CACHED_FRAME:
+        return pack(loads(text))
+    return _cached_frame_to_msgpack(text)
+
+
+@lru_cache(maxsize=256)
+def _cached_frame_to_msgpack(text):
+    return pack(loads(text))
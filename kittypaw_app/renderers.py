@@ -0,0 +1,29 @@
+import json
+from rest_framework.renderers import BaseRenderer
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Solo negocia `?format=csv`; el cuerpo lo genera la vista en streaming y
+    las respuestas de error se devuelven con JSONRenderer (ver
+    SensorDataExportView.finalize_response).
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode(self.charset)
@@ -0,0 +1,55 @@
+import logging
+from django.db import connection, transaction
+from django.db.models import Max
+from .models import SensorData, RollupWatermark
+from .aggregation import ROLLUPS, ROLLUP_WATERMARK, BUCKET_ORIGIN
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = """
+    INSERT INTO {rollup} (device_id, sensor_type, bucket, sample_count, value_sum, value_min, value_max)
+    SELECT device_id, sensor_type, date_bin(%s, "timestamp", %s), COUNT(value), SUM(value), MIN(value), MAX(value)
+    FROM {raw}
+    WHERE id > %s AND id <= %s AND value IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (device_id, sensor_type, bucket) DO UPDATE SET
+        sample_count = {rollup}.sample_count + EXCLUDED.sample_count,
+        value_sum = {rollup}.value_sum + EXCLUDED.value_sum,
+        value_min = LEAST({rollup}.value_min, EXCLUDED.value_min),
+        value_max = GREATEST({rollup}.value_max, EXCLUDED.value_max)
+"""
+
+
+def refresh_rollups(batch_size=100000):
+    """
+    Incorpora a los rollups las lecturas con id posterior al watermark.
+
+    Solo se procesa hasta el máximo id observado en la ejecución anterior, de
+    modo que las filas de transacciones todavía abiertas no queden saltadas.
+    Devuelve la cantidad de ids procesados.
+    """
+    quote = connection.ops.quote_name
+    raw_table = quote(SensorData._meta.db_table)
+
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=ROLLUP_WATERMARK)
+        last_id = watermark.last_id
+        upper = min(watermark.pending_id, last_id + batch_size)
+
+        if upper > last_id:
+            with connection.cursor() as cursor:
+                for granularity, model in ROLLUPS:
+                    cursor.execute(
+                        UPSERT_SQL.format(rollup=quote(model._meta.db_table), raw=raw_table),
+                        [granularity, BUCKET_ORIGIN, last_id, upper]
+                    )
+            watermark.last_id = upper
+
+        current_max = SensorData.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        watermark.pending_id = max(watermark.pending_id, current_max)
+        watermark.save()
+
+    processed = max(0, upper - last_id)
+    if processed:
+        logger.info(f"Rollups actualizados: ids {last_id + 1}-{upper}")
+    return processed
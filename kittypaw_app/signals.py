@@ -0,0 +1,36 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .access import invalidate_access
+from .models import Device, Pet, PetOwner
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device_cache(sender, instance, **kwargs):
+    """
+    Descarta la copia en caché del dispositivo en el cliente MQTT
+    """
+    from .mqtt_client import mqtt_client
+    mqtt_client.devices.invalidate(instance.device_id)
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_delete, sender=Pet)
+def invalidate_pet_device_cache(sender, instance, **kwargs):
+    """
+    El propietario de un collar se guarda en su entrada de caché
+    """
+    from .mqtt_client import mqtt_client
+    if instance.kitty_paw_device_id:
+        mqtt_client.devices.invalidate(instance.kitty_paw_device_id)
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_delete, sender=Pet)
+@receiver(post_save, sender=PetOwner)
+@receiver(post_delete, sender=PetOwner)
+def invalidate_access_cache(sender, instance, **kwargs):
+    """
+    Las mascotas y collares visibles por usuario se guardan en caché
+    """
+    invalidate_access()
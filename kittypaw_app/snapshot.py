@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from .models import Device, SensorData
+from .payloads import SENSOR_TYPES, loads, pack
+
+# Lecturas por dispositivo y tipo de sensor en la instantánea inicial
+SNAPSHOT_READINGS = 60
+
+
+def snapshot_query(device_ids=None):
+    """
+    SQL y parámetros de las últimas SNAPSHOT_READINGS lecturas de cada
+    dispositivo y tipo de sensor. Cada serie es un LATERAL con LIMIT que
+    recorre sensordata_dev_type_ts_idx desde la lectura más reciente, así que
+    el costo depende de las series pedidas y no del volumen de la tabla. Sin
+    límite de antigüedad: un collar inactivo conserva sus últimas lecturas.
+    `device_ids` None significa todos los dispositivos.
+    """
+    device_filter = ''
+    params = [list(SENSOR_TYPES), SNAPSHOT_READINGS]
+    if device_ids is not None:
+        device_filter = 'WHERE d.device_id = ANY(%s)'
+        params.append(list(device_ids))
+    sql = f"""
+        SELECT d.device_id, t.sensor_type, r.value, r.unit, r."timestamp"
+        FROM {Device._meta.db_table} d
+        CROSS JOIN unnest(%s::varchar[]) AS t(sensor_type)
+        CROSS JOIN LATERAL (
+            SELECT s.value, s.unit, s."timestamp"
+            FROM {SensorData._meta.db_table} s
+            WHERE s.device_id = d.device_id
+              AND s.sensor_type = t.sensor_type
+              AND s.value IS NOT NULL
+            ORDER BY s."timestamp" DESC
+            LIMIT %s
+        ) r
+        {device_filter}
+        ORDER BY d.device_id, t.sensor_type, r."timestamp"
+    """
+    return sql, params
+
+
+def build_snapshot(device_ids=None):
+    """
+    Trama inicial del WebSocket: dispositivos visibles y sus últimas lecturas,
+    obtenidas en una sola consulta (ver snapshot_query).
+    `device_ids` None significa todos los dispositivos.
+    """
+    devices = Device.objects.order_by('id')
+    if device_ids is not None:
+        devices = devices.filter(device_id__in=device_ids)
+    devices = list(devices.values())
+    series = {(device['device_id'], sensor_type): [] for device in devices for sensor_type in SENSOR_TYPES}
+
+    sql, params = snapshot_query(device_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for device_id, sensor_type, value, unit, timestamp in cursor:
+            points = series.get((device_id, sensor_type))
+            if points is not None:
+                points.append({'value': value, 'unit': unit, 'timestamp': timestamp.isoformat()})
+
+    return json.dumps({
+        'type': 'snapshot',
+        'devices': devices,
+        'sensorData': [
+            {'deviceId': device_id, 'sensorType': sensor_type, 'data': points}
+            for (device_id, sensor_type), points in series.items()
+        ]
+    }, cls=DjangoJSONEncoder)
+
+
+class SnapshotCache:
+    """
+    Instantáneas ya serializadas por conjunto de dispositivos visibles,
+    válidas `ttl` segundos. Las conexiones simultáneas que piden el mismo
+    conjunto esperan una única construcción en curso. La versión MessagePack
+    se genera una vez por entrada, al pedirla la primera conexión binaria.
+    Se guardan como mucho MAX_ENTRIES conjuntos; al llenarse se descarta el
+    usado hace más tiempo.
+    """
+    MAX_ENTRIES = 256
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'WS_SNAPSHOT_TTL', 5)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.builds = 0
+
+    async def get(self, device_ids=None, binary=False):
+        key = None if device_ids is None else frozenset(device_ids)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(self._build(key))
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # Que la cancelación de una conexión no cancele la construcción compartida
+            entry = await asyncio.shield(future)
+
+        if not binary:
+            return entry[1]
+        if entry[2] is None:
+            entry[2] = pack(loads(entry[1]))
+        return entry[2]
+
+    async def _build(self, key):
+        text = await database_sync_to_async(build_snapshot)(key)
+        self.builds += 1
+        # [vencimiento, texto JSON, bytes MessagePack o None]
+        entry = [time.monotonic() + self.ttl, text, None]
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+        return entry
+
+
+snapshot_cache = SnapshotCache()
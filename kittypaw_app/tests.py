@@ -1,3 +1,1040 @@
-from django.test import TestCase
+import asyncio
+import json
+import socket
+import threading
+from datetime import date, datetime, timezone as dt_timezone
+from unittest import mock, skipIf, skipUnless
+import psycopg2
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .channel_layers import PostgresChannelLayer
+from .export import export_stream
+from .device_cache import DeviceRegistry
+from .aggregation import bucketed_series
+from .ingestion import DeviceStateBuffer, IngestItem, SensorDataWriter, upsert_latest_readings
+from .payloads import MAX_SAMPLES_PER_PACKET, PayloadError, decode_message, msgpack
+from .snapshot import SNAPSHOT_READINGS, SnapshotCache, build_snapshot
+from .lifespan import MqttEngineMiddleware
+from .access import GENERATION_KEY, accessible_device_ids, can_access_device
+from .consumers import SensorDataConsumer
+from .groups import ALL_DEVICES_GROUP, device_group, owner_group
+from .metrics import SystemMetricsCache
+from .mqtt_async import AsyncMqttClient
+from .mqtt_client import MqttClient, mqtt_client
+from .offline import OfflineDetector
+from .rollups import refresh_rollups
+from .partitions import DEFAULT_PARTITION, add_months, create_future_partitions, month_start, partition_name
+from .models import Device, LatestSensorReading, MqttTopic, Pet, PetOwner, SensorData, User
 
-# Create your tests here.
+
+class PetListQueryTests(TestCase):
+    """
+    El listado de mascotas no debe lanzar una consulta por fila (owner_name,
+    kitty_paw_device)
+    """
+
+    def create_pets(self, owner, count, start=0):
+        devices = Device.objects.bulk_create(
+            Device(device_id=f"KPCL{n:05d}", name=f"Collar {n}", type='KPCL')
+            for n in range(start, start + count)
+        )
+        Pet.objects.bulk_create(
+            Pet(owner=owner, name=f"Mascota {n}", chip_number=f"CHIP{n:05d}", breed='Mestizo',
+                species='Gato', acquisition_date=timezone.now(), origin='Refugio',
+                kitty_paw_device_id=device.device_id)
+            for n, device in zip(range(start, start + count), devices)
+        )
+
+    def create_owner(self, username):
+        return PetOwner.objects.create(
+            name='Ana', paternal_last_name='Pérez', address='Calle 1', birth_date=timezone.now(),
+            email=f"{username}@example.com", username=username, password='-'
+        )
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/pets/', {'page_size': 500})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()['results']
+
+    def test_listing_is_constant_in_number_of_pets(self):
+        owner = self.create_owner('ana')
+        self.client.force_login(User.objects.create_user('admin', 'x', role='admin'))
+
+        self.create_pets(owner, 1)
+        baseline, results = self.list_queries()
+        self.assertEqual(len(results), 1)
+
+        self.create_pets(owner, 999, start=1)
+        with self.assertNumQueries(baseline):
+            response = self.client.get('/api/pets/', {'page_size': 500})
+        self.assertEqual(len(response.json()['results']), 500)
+        self.assertEqual(response.json()['results'][0]['owner_name'], 'Ana Pérez')
+
+    def test_owner_only_sees_own_pets(self):
+        owner = self.create_owner('ana')
+        other = self.create_owner('luis')
+        self.create_pets(owner, 3)
+        self.create_pets(other, 2, start=3)
+        self.client.force_login(User.objects.create_user('ana', 'x'))
+
+        _, results = self.list_queries()
+        self.assertEqual({pet['owner'] for pet in results}, {owner.pk})
+        self.assertEqual(len(results), 3)
+
+
+class SystemMetricsCacheTests(TestCase):
+    def setUp(self):
+        cache.delete(SystemMetricsCache.KEY)
+        cache.delete(SystemMetricsCache.REFRESH_LOCK_KEY)
+
+    def test_stale_metrics_are_served_while_refreshing(self):
+        metrics = SystemMetricsCache(interval=0)
+        with self.assertNumQueries(2):
+            first = metrics.get()
+
+        # Vencida: se devuelve la copia anterior sin consultar y se recalcula aparte
+        with mock.patch.object(metrics, 'refresh_in_background') as refresh, self.assertNumQueries(0):
+            self.assertEqual(metrics.get(), first)
+        refresh.assert_called_once_with()
+
+
+class LatestReadingUpsertTests(TestCase):
+    def setUp(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+
+    def test_older_reading_does_not_replace_newer(self):
+        now = timezone.now()
+        upsert_latest_readings([('KPCL0001', 'temperature', 21.5, '°C', now)])
+        upsert_latest_readings([('KPCL0001', 'temperature', 18.0, '°C', now - timezone.timedelta(minutes=5))])
+
+        latest = LatestSensorReading.objects.get(device_id='KPCL0001', sensor_type='temperature')
+        self.assertEqual((latest.value, latest.timestamp), (21.5, now))
+
+        upsert_latest_readings([('KPCL0001', 'temperature', 22.0, '°C', now + timezone.timedelta(seconds=1))])
+        latest.refresh_from_db()
+        self.assertEqual(latest.value, 22.0)
+
+
+class CollarDecoderTests(SimpleTestCase):
+    def test_json_message(self):
+        raw = b'{"device_id": "KPCL0001", "temperature": 21.5, "humidity": "40", "battery": "87", "timestamp": "17/10/2026, 10:00:01"}'
+        [(item, frame)] = decode_message(raw, 'KPCL0001')
+
+        self.assertEqual((item.device_id, item.status, item.battery), ('KPCL0001', 'online', 87))
+        self.assertEqual(item.timestamp, timezone.make_aware(datetime(2026, 10, 17, 10, 0, 1)))
+        self.assertEqual(item.readings, [('temperature', 21.5, '°C'), ('humidity', 40.0, '%')])
+        # El JSON del collar se reenvía sin volver a serializarlo
+        self.assertEqual(frame, '{"type":"sensorData","deviceId":"KPCL0001","data":' + raw.decode() + '}')
+
+    def test_json_device_id_must_match_topic(self):
+        with self.assertRaises(PayloadError):
+            decode_message(b'{"device_id": "KPCL0002", "temperature": 21.5}', 'KPCL0001')
+        [(item, _)] = decode_message(b'{"temperature": 21.5}', 'KPCL0001')
+        self.assertEqual(item.device_id, 'KPCL0001')
+
+    def test_invalid_json(self):
+        for raw in (b'{"temperature": ', b'[1, 2]', b'\xff\xfe'):
+            with self.assertRaises(PayloadError):
+                decode_message(raw, 'KPCL0001')
+
+    @skipIf(msgpack is None, 'msgpack no instalado')
+    def test_binary_message_with_several_samples(self):
+        raw = msgpack.packb({'d': 'KPCL0001', 's': 'online', 'b': 80, 'r': [
+            {'t': 1760000000, 'T': 21.5, 'W': 4.2},
+            {'t': 1760000001, 'H': 40},
+        ]})
+        decoded = decode_message(raw, 'KPCL0001')
+
+        self.assertEqual([item.timestamp.timestamp() for item, _ in decoded], [1760000000, 1760000001])
+        self.assertEqual(decoded[0][0].readings, [('temperature', 21.5, '°C'), ('weight', 4.2, 'kg')])
+        self.assertEqual(decoded[1][0].readings, [('humidity', 40.0, '%')])
+        self.assertEqual(json.loads(decoded[0][1])['data']['battery'], 80)
+
+    @skipIf(msgpack is None, 'msgpack no instalado')
+    def test_binary_message_limits(self):
+        too_many = msgpack.packb({'d': 'KPCL0001', 'r': [{'T': 1}] * (MAX_SAMPLES_PER_PACKET + 1)})
+        for raw in (too_many, msgpack.packb({'d': 'KPCL0001', 'r': [1]}), msgpack.packb({'d': 'KPCL0002', 'T': 1})):
+            with self.assertRaises(PayloadError):
+                decode_message(raw, 'KPCL0001')
+
+    def test_non_finite_values_are_dropped(self):
+        raw = b'{"device_id": "KPCL0001", "temperature": "NaN", "humidity": "-inf", "light": "1e999", "weight": 4.2}'
+        [(item, frame)] = decode_message(raw, 'KPCL0001')
+
+        self.assertEqual([(sensor_type, value) for sensor_type, value, _ in item.readings], [('weight', 4.2)])
+        # La trama se rehace sin los valores descartados y es JSON estricto
+        data = json.loads(frame, parse_constant=self.fail)['data']
+        self.assertNotIn('temperature', data)
+        self.assertEqual(data['weight'], 4.2)
+
+    @skipIf(msgpack is None, 'msgpack no instalado')
+    def test_non_finite_binary_values_are_dropped(self):
+        raw = msgpack.packb({'d': 'KPCL0001', 'r': [{'t': 1760000000, 'T': float('nan'), 'W': 4.2}]})
+        [(item, frame)] = decode_message(raw, 'KPCL0001')
+        self.assertEqual([(sensor_type, value) for sensor_type, value, _ in item.readings], [('weight', 4.2)])
+
+
+class SnapshotCacheTests(TestCase):
+    @skipIf(msgpack is None, 'msgpack no instalado')
+    async def test_binary_snapshot_is_packed_once_per_entry(self):
+        snapshots = SnapshotCache(ttl=60)
+        text = json.dumps({'type': 'snapshot', 'devices': [], 'sensorData': []})
+        with mock.patch('kittypaw_app.snapshot.build_snapshot', return_value=text) as build, \
+                mock.patch('kittypaw_app.snapshot.pack', wraps=msgpack.packb) as packer:
+            self.assertEqual(await snapshots.get({'KPCL0001'}), text)
+            packed = await snapshots.get({'KPCL0001'}, binary=True)
+            self.assertIs(await snapshots.get({'KPCL0001'}, binary=True), packed)
+
+        self.assertEqual(msgpack.unpackb(packed), json.loads(text))
+        build.assert_called_once()
+        packer.assert_called_once()
+
+    async def test_least_recently_used_entry_is_evicted(self):
+        snapshots = SnapshotCache(ttl=60)
+        snapshots.MAX_ENTRIES = 2
+        with mock.patch('kittypaw_app.snapshot.build_snapshot', side_effect=lambda key: str(sorted(key))) as build:
+            await snapshots.get({'A'})
+            await snapshots.get({'B'})
+            await snapshots.get({'A'})
+            await snapshots.get({'C'})
+            self.assertEqual(list(snapshots._entries), [frozenset({'A'}), frozenset({'C'})])
+            await snapshots.get({'A'})
+            await snapshots.get({'B'})
+        self.assertEqual(build.call_count, 4)
+        self.assertEqual(len(snapshots._entries), 2)
+
+
+class SensorDataExportTests(TestCase):
+    def setUp(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        self.client.force_login(User.objects.create_user('admin', 'x', role='admin'))
+
+    def test_csv_export_streams_rows_in_time_order(self):
+        now = timezone.now()
+        SensorData.objects.bulk_create(
+            SensorData(device_id='KPCL0001', timestamp=now - timezone.timedelta(minutes=n),
+                       sensor_type='temperature', value=20 + n, unit='°C', data={})
+            for n in range(3)
+        )
+        response = self.client.get('/api/sensor-data/KPCL0001/export/', {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'timestamp,sensor_type,value,unit')
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['22.0', '21.0', '20.0'])
+
+    def test_errors_are_json(self):
+        response = self.client.get('/api/sensor-data/KPCL0001/export/', {'format': 'csv', 'from': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('message', response.json())
+
+    async def test_asgi_stream_reads_inside_one_transaction(self):
+        await SensorData.objects.acreate(device_id='KPCL0001', sensor_type='light', value=300, unit='lux', data={})
+        stream = export_stream(SensorData.objects.all(), 'ndjson', asynchronous=True)
+        chunks = [chunk async for chunk in stream]
+        self.assertEqual(json.loads(chunks[0])['value'], 300)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'La instantánea usa LATERAL y unnest de PostgreSQL')
+class SnapshotQueryTests(TestCase):
+    def test_latest_readings_per_type_in_time_order(self):
+        for device_id in ('KPCL0001', 'KPCL0002'):
+            Device.objects.create(device_id=device_id, name='Collar', type='KPCL')
+        # Collar inactivo desde hace días: conserva sus últimas lecturas
+        start = timezone.now() - timezone.timedelta(days=10)
+        total = SNAPSHOT_READINGS + 5
+        SensorData.objects.bulk_create(
+            [SensorData(device_id='KPCL0001', timestamp=start + timezone.timedelta(minutes=n),
+                        sensor_type='temperature', value=n, unit='°C', data={}) for n in range(total)]
+            + [SensorData(device_id='KPCL0001', timestamp=start, sensor_type='light', value=None, data={}),
+               SensorData(device_id='KPCL0001', timestamp=start, sensor_type='light', value=300, unit='lux', data={}),
+               SensorData(device_id='KPCL0002', timestamp=start, sensor_type='light', value=1, unit='lux', data={})]
+        )
+
+        snapshot = json.loads(build_snapshot(['KPCL0001']))
+        self.assertEqual([device['device_id'] for device in snapshot['devices']], ['KPCL0001'])
+        series = {row['sensorType']: [point['value'] for point in row['data']] for row in snapshot['sensorData']}
+        self.assertEqual(series['temperature'], [float(n) for n in range(total - SNAPSHOT_READINGS, total)])
+        self.assertEqual(series['light'], [300.0])
+        self.assertEqual(series['humidity'], [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SensorData solo está particionada en PostgreSQL')
+class SensorDataPartitionTests(TestCase):
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+    def test_rows_in_default_partition_move_to_the_new_month(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        month = add_months(month_start(date.today()), 24)
+        # Sin partición para ese mes, la lectura cae en la partición por defecto
+        SensorData.objects.create(
+            device_id='KPCL0001', timestamp=datetime(month.year, month.month, 15, tzinfo=dt_timezone.utc),
+            sensor_type='temperature', value=21.0, unit='°C', data={}
+        )
+        self.assertEqual(self.count(DEFAULT_PARTITION), 1)
+
+        created = create_future_partitions(24)
+
+        self.assertIn(partition_name(month), created)
+        self.assertEqual(self.count(partition_name(month)), 1)
+        self.assertEqual(self.count(DEFAULT_PARTITION), 0)
+
+
+class GroupRoutingTests(TestCase):
+    def test_owner_group_resolved_when_device_is_not_cached(self):
+        owner = PetOwner.objects.create(
+            name='Ana', paternal_last_name='Pérez', address='Calle 1', birth_date=timezone.now(),
+            email='ana@example.com', username='ana', password='-'
+        )
+        device = Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        Pet.objects.create(owner=owner, name='Malto', chip_number='CHIP1', breed='Mestizo', species='Gato',
+                           acquisition_date=timezone.now(), origin='Refugio', kitty_paw_device=device)
+
+        client = MqttClient()
+        self.assertIsNone(client.devices.peek('KPCL0001'))
+        groups = {group for group, _ in client.group_messages(
+            {'type': 'deviceStatus', 'deviceId': 'KPCL0001', 'status': 'online'}
+        )}
+        self.assertIn(device_group('KPCL0001'), groups)
+        self.assertIn(owner_group(owner.pk), groups)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY solo existe en PostgreSQL')
+class PostgresChannelLayerTests(TransactionTestCase):
+    async def test_group_send_reaches_another_instance(self):
+        sender = PostgresChannelLayer(channel='kittypaw_test')
+        receiver = PostgresChannelLayer(channel='kittypaw_test')
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('devices_all', channel)
+
+            small = {'type': 'send_sensor_data', 'text': 'x'}
+            # Supera el límite de NOTIFY: viaja por la tabla de desbordamiento
+            large = {'type': 'send_sensor_data', 'text': 'x' * (PostgresChannelLayer.MAX_PAYLOAD * 2)}
+            for message in (small, large):
+                await sender.group_send('devices_all', message)
+                self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 5), message)
+        finally:
+            await sender.close()
+            await receiver.close()
+
+    async def test_listen_connection_is_reopened_after_it_drops(self):
+        sender = PostgresChannelLayer(channel='kittypaw_test')
+        receiver = PostgresChannelLayer(channel='kittypaw_test')
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('devices_all', channel)
+            dropped = receiver._listen_conn
+            # El servidor corta la conexión LISTEN del receptor
+            def terminate(cursor):
+                cursor.execute('SELECT pg_terminate_backend(%s)', [dropped.get_backend_pid()])
+            await asyncio.get_running_loop().run_in_executor(None, sender._execute, terminate)
+            for _ in range(50):
+                if receiver._listen_conn is not None and receiver._listen_conn is not dropped:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertIsNot(receiver._listen_conn, dropped)
+
+            message = {'type': 'send_sensor_data', 'text': 'x'}
+            await sender.group_send('devices_all', message)
+            self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 5), message)
+        finally:
+            await sender.close()
+            await receiver.close()
+
+
+class PostgresChannelLayerReconnectTests(SimpleTestCase):
+    class FakeConnection:
+        """
+        Conexión LISTEN simulada sobre un socketpair para que add_reader funcione
+        """
+        def __init__(self):
+            self.sock, self.peer = socket.socketpair()
+            self.notifies = []
+            self.closed = False
+            self.broken = False
+
+        def fileno(self):
+            return self.sock.fileno()
+
+        def poll(self):
+            self.sock.recv(1)
+            if self.broken:
+                raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        def wake(self):
+            self.peer.send(b'x')
+
+        def close(self):
+            self.closed = True
+            self.sock.close()
+            self.peer.close()
+
+    async def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('la condición no se cumplió')
+
+    async def test_reader_error_reopens_listen_without_a_new_receive(self):
+        connections = []
+
+        def open_listen_conn():
+            connections.append(self.FakeConnection())
+            return connections[-1]
+
+        layer = PostgresChannelLayer()
+        with mock.patch.object(layer, '_open_listen_conn', side_effect=open_listen_conn):
+            channel = await layer.new_channel()
+            await layer.group_add('devices_all', channel)
+            self.assertEqual(len(connections), 1)
+
+            connections[0].broken = True
+            connections[0].wake()
+            await self.wait_for(lambda: layer._listen_conn is not None and len(connections) == 2)
+            self.assertTrue(connections[0].closed)
+
+            # La nueva conexión entrega las notificaciones a los grupos existentes
+            message = {'type': 'send_sensor_data', 'text': 'x'}
+            connections[1].notifies.append(mock.Mock(payload=json.dumps({'g': 'devices_all', 'm': message})))
+            connections[1].wake()
+            self.assertEqual(await asyncio.wait_for(layer.receive(channel), 2), message)
+            self.assertEqual(len(connections), 2)
+            await layer.close()
+        self.assertTrue(connections[1].closed)
+
+
+class OfflineDetectorTests(SimpleTestCase):
+    def detector(self, on_expired=None):
+        return OfflineDetector(on_expired=on_expired or (lambda device_id: None),
+                               timeouts_ms={'default': 15000, 'KPCL': 1000})
+
+    @mock.patch('kittypaw_app.offline.time.monotonic')
+    def test_expires_once_at_the_type_deadline(self, monotonic):
+        detector = self.detector()
+        monotonic.return_value = 100.0
+        detector.touch('KPCL0001', 'KPCL')
+        detector.touch('OTHER', 'placa')
+
+        self.assertEqual(detector._pop_expired(100.9), [])
+        self.assertEqual(detector._pop_expired(101.0), ['KPCL0001'])
+        self.assertEqual(detector._pop_expired(101.0), [])
+        self.assertEqual(detector.tracked(), 1)
+        self.assertEqual(detector._pop_expired(115.0), ['OTHER'])
+
+    @mock.patch('kittypaw_app.offline.time.monotonic')
+    def test_touch_postpones_without_duplicating_heap_entries(self, monotonic):
+        detector = self.detector()
+        for now in (100.0, 100.5, 100.8):
+            monotonic.return_value = now
+            detector.touch('KPCL0001', 'KPCL')
+        self.assertEqual(len(detector._heap), 1)
+
+        # La entrada vieja se reprograma al llegar a la cima
+        self.assertEqual(detector._pop_expired(101.0), [])
+        self.assertEqual(detector._pop_expired(101.8), ['KPCL0001'])
+        self.assertEqual(detector._heap, [])
+
+    def test_thread_reports_expired_devices(self):
+        expired = threading.Event()
+        detector = OfflineDetector(on_expired=lambda device_id: expired.set(), timeouts_ms={'default': 20})
+        detector.start()
+        try:
+            detector.touch('KPCL0001')
+            self.assertTrue(expired.wait(2))
+            self.assertEqual(detector.expired_count, 1)
+        finally:
+            detector.stop()
+
+
+class DeviceStateBufferTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL',
+                                            status='offline', battery_level=80)
+        Device.objects.create(device_id='KPCL0002', name='Collar 2', type='KPCL', status='online', battery_level=50)
+        self.buffer = DeviceStateBuffer(DeviceRegistry())
+
+    def test_coalesces_changes_and_writes_only_changed_fields(self):
+        self.assertTrue(self.buffer.set_status('KPCL0001', 'online'))
+        self.assertFalse(self.buffer.set_status('KPCL0001', 'online'))
+        self.assertTrue(self.buffer.set_battery('KPCL0001', 75))
+        self.assertFalse(self.buffer.set_status('KPCL0002', 'online'))
+        self.assertFalse(self.buffer.set_status('NOEXISTE', 'online'))
+        self.assertEqual(self.buffer.pending(), 1)
+
+        # Un cambio hecho por otro proceso en una columna no marcada se conserva
+        Device.objects.filter(device_id='KPCL0001').update(name='Renombrado')
+        with self.assertNumQueries(3):  # SAVEPOINT, UPDATE, RELEASE
+            self.assertEqual(self.buffer.flush(), 1)
+
+        self.device.refresh_from_db()
+        self.assertEqual((self.device.status, self.device.battery_level, self.device.name),
+                         ('online', 75, 'Renombrado'))
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    @mock.patch('kittypaw_app.ingestion.connection')
+    def test_failed_flush_requeues_without_overwriting_newer_changes(self, _connection):
+        self.buffer.set_status('KPCL0001', 'online')
+        self.buffer.set_battery('KPCL0001', 70)
+        with mock.patch.object(Device.objects, 'bulk_update', side_effect=DatabaseError('caída')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending(), 1)
+
+        # Llega un estado más reciente antes del reintento
+        self.buffer.set_status('KPCL0001', 'offline')
+        self.assertEqual(self.buffer.flush(), 1)
+
+        self.device.refresh_from_db()
+        self.assertEqual((self.device.status, self.device.battery_level), ('offline', 70))
+        self.assertEqual(self.buffer.stats(), {'pending': 0, 'flushes': 1, 'writtenDevices': 1})
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', 'x', role='admin'))
+
+    def walk(self, url, params):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            body = response.json()
+            ids += [row['id'] for row in body['results']]
+            if not body['next']:
+                return ids
+            response = self.client.get(body['next'])
+
+    def test_sensor_data_pages_newest_first_without_duplicates(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        now = timezone.now().replace(microsecond=0)
+        # Varias lecturas comparten timestamp: el desempate es por id
+        readings = SensorData.objects.bulk_create(
+            SensorData(device_id='KPCL0001', timestamp=now - timezone.timedelta(seconds=n // 3),
+                       sensor_type='temperature', value=n, unit='°C', data={})
+            for n in range(7)
+        )
+        expected = [r.pk for r in sorted(
+            SensorData.objects.all(), key=lambda r: (r.timestamp, r.pk), reverse=True
+        )]
+        self.assertEqual(len(expected), len(readings))
+        self.assertEqual(self.walk('/api/sensor-data/KPCL0001/', {'limit': 2}), expected)
+
+    def test_invalid_sensor_data_cursor_is_not_found(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        response = self.client.get('/api/sensor-data/KPCL0001/', {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_viewsets_page_by_id(self):
+        for n in range(5):
+            Device.objects.create(device_id=f'KPCL000{n}', name='Collar', type='KPCL')
+        expected = list(Device.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/devices/', {'page_size': 2}), expected)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'date_bin solo existe en PostgreSQL 14+')
+class BucketedSeriesTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        self.base = timezone.now().replace(minute=0, second=0, microsecond=0) - timezone.timedelta(hours=2)
+
+    def add(self, minutes, value):
+        SensorData.objects.create(device=self.device, timestamp=self.base + timezone.timedelta(minutes=minutes),
+                                  sensor_type='temperature', value=value, unit='°C', data={})
+
+    def series(self):
+        return bucketed_series(self.device, 'temperature', '1h', ['avg', 'min', 'max', 'count'],
+                               self.base, self.base + timezone.timedelta(hours=2))['temperature']
+
+    def test_combines_rollups_with_raw_tail_without_double_counting(self):
+        self.add(1, 10)
+        self.add(2, 20)
+        # La primera pasada fija el tope visible; la segunda consolida hasta él
+        refresh_rollups()
+        self.assertEqual(refresh_rollups(), 2)
+
+        # Cola posterior al watermark, en el mismo bucket y en el siguiente
+        self.add(3, 30)
+        self.add(61, 5)
+        expected = {
+            't': [self.base.isoformat(), (self.base + timezone.timedelta(hours=1)).isoformat()],
+            'avg': [20.0, 5.0], 'min': [10.0, 5.0], 'max': [30.0, 5.0], 'count': [3, 1],
+        }
+        self.assertEqual(self.series(), expected)
+
+        refresh_rollups()
+        self.assertEqual(refresh_rollups(), 2)
+        self.assertEqual(self.series(), expected)
+
+
+class MqttEngineMiddlewareTests(SimpleTestCase):
+    async def app(self, scope, receive, send):
+        pass
+
+    async def run_lifespan(self, middleware):
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await middleware({'type': 'lifespan'}, receive, send)
+        return sent
+
+    async def test_web_process_does_not_connect_by_default(self):
+        with self.settings():
+            del settings.MQTT_ENGINE
+            middleware = MqttEngineMiddleware(self.app)
+        with mock.patch.object(MqttEngineMiddleware, 'startup') as startup:
+            sent = await self.run_lifespan(middleware)
+            # Tampoco con la primera conexión entrante
+            await middleware({'type': 'http'}, None, None)
+        self.assertFalse(middleware.enabled)
+        startup.assert_not_called()
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    async def test_in_process_engine_is_opt_in(self):
+        with self.settings(MQTT_ENGINE='thread'):
+            middleware = MqttEngineMiddleware(self.app)
+        with mock.patch.object(MqttEngineMiddleware, 'startup') as startup, \
+                mock.patch.object(MqttEngineMiddleware, 'shutdown') as shutdown:
+            await self.run_lifespan(middleware)
+        startup.assert_awaited_once()
+        shutdown.assert_awaited_once()
+
+
+def create_owner(username):
+    return PetOwner.objects.create(
+        name=username.title(), paternal_last_name='Pérez', address='Calle 1', birth_date=timezone.now(),
+        email=f'{username}@example.com', username=username, password='-'
+    )
+
+
+def create_pet(owner, device, chip):
+    return Pet.objects.create(owner=owner, name='Malto', chip_number=chip, breed='Mestizo', species='Gato',
+                              acquisition_date=timezone.now(), origin='Refugio', kitty_paw_device=device)
+
+
+class LatestReadingsViewTests(TestCase):
+    URL = '/api/latest-readings/'
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        for device_id in ('KPCL0001', 'KPCL0002'):
+            device = Device.objects.create(device_id=device_id, name='Collar', type='KPCL')
+            for sensor_type in ('temperature', 'light'):
+                self.reading(device_id, sensor_type, 1)
+        create_pet(create_owner('ana'), device, 'CHIP1')
+        self.client.force_login(User.objects.create_user('admin', 'x', role='admin'))
+
+    def reading(self, device_id, sensor_type, value):
+        LatestSensorReading.objects.update_or_create(
+            device_id=device_id, sensor_type=sensor_type,
+            defaults={'value': value, 'unit': '', 'timestamp': self.now},
+        )
+
+    def keys(self, response):
+        return [(row['deviceId'], row['sensorType']) for row in response.json()]
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+        etag = response['ETag']
+
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.reading('KPCL0001', 'light', 2)
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_when_the_set_changes_with_the_same_count(self):
+        etag = self.client.get(self.URL, {'type': 'light'})['ETag']
+        # Sale una fila y entra otra con una escritura más antigua: mismo
+        # número de filas y misma escritura más reciente
+        LatestSensorReading.objects.filter(device_id='KPCL0001', sensor_type='light').delete()
+        Device.objects.create(device_id='KPCL0003', name='Collar', type='KPCL')
+        self.reading('KPCL0003', 'light', 1)
+        LatestSensorReading.objects.filter(device_id='KPCL0003').update(updated_at=self.now - timezone.timedelta(hours=1))
+
+        response = self.client.get(self.URL, {'type': 'light'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.keys(response), [('KPCL0002', 'light'), ('KPCL0003', 'light')])
+
+    def test_filters_by_device_and_type(self):
+        response = self.client.get(self.URL, {'device': 'KPCL0001'})
+        self.assertEqual(self.keys(response), [('KPCL0001', 'light'), ('KPCL0001', 'temperature')])
+        response = self.client.get(self.URL, {'type': 'temperature'})
+        self.assertEqual(self.keys(response), [('KPCL0001', 'temperature'), ('KPCL0002', 'temperature')])
+        response = self.client.get(self.URL, {'device': 'KPCL0002', 'type': 'light'})
+        self.assertEqual(self.keys(response), [('KPCL0002', 'light')])
+
+    def test_owner_only_sees_their_devices(self):
+        self.client.force_login(User.objects.create_user('ana', 'x'))
+        response = self.client.get(self.URL)
+        self.assertEqual({device_id for device_id, _ in self.keys(response)}, {'KPCL0002'})
+        self.assertEqual(self.client.get(self.URL, {'device': 'KPCL0001'}).json(), [])
+
+
+class SensorDataConsumerRateTests(SimpleTestCase):
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(SensorDataConsumer.as_asgi(), path)
+        communicator.scope['user'] = User(username='admin', role='admin')
+        patcher = mock.patch('kittypaw_app.consumers.snapshot_cache')
+        patcher.start().get = mock.AsyncMock(return_value='{"type": "initialData"}')
+        self.addCleanup(patcher.stop)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_from(), '{"type": "initialData"}')
+        return communicator
+
+    async def publish(self, sensor_type, value):
+        await get_channel_layer().group_send(ALL_DEVICES_GROUP, {
+            'type': 'send_sensor_data',
+            'text': json.dumps({'type': 'sensorData', 'sensorType': sensor_type, 'value': value}),
+            'deviceId': 'KPCL0001',
+            'timestamp': f'2026-01-01T00:00:0{value}Z',
+            'readings': [[sensor_type, value]],
+        })
+
+    async def assert_single_batch(self, communicator):
+        for sensor_type, value in (('temperature', 1), ('temperature', 2), ('light', 5), ('temperature', 3)):
+            await self.publish(sensor_type, value)
+        batch = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(batch['type'], 'sensorBatch')
+        self.assertEqual(sorted((row['sensorType'], row['value'], row['timestamp']) for row in batch['data']), [
+            ('light', 5, '2026-01-01T00:00:05Z'), ('temperature', 3, '2026-01-01T00:00:03Z'),
+        ])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+
+    async def test_rate_conflates_readings_into_one_batch(self):
+        communicator = await self.connect('/ws/sensor-data/?rate=1')
+        await self.assert_single_batch(communicator)
+        await communicator.disconnect()
+
+    async def test_set_rate_switches_to_batches(self):
+        communicator = await self.connect('/ws/sensor-data/')
+        await communicator.send_json_to({'type': 'set_rate', 'rate': 1})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'rate', 'rate': 1.0})
+        await self.assert_single_batch(communicator)
+        await communicator.disconnect()
+
+    async def test_without_rate_every_reading_is_sent(self):
+        communicator = await self.connect('/ws/sensor-data/?rate=0')
+        await self.publish('temperature', 1)
+        await self.publish('temperature', 2)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'sensorData', 'sensorType': 'temperature', 'value': 1})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'sensorData', 'sensorType': 'temperature', 'value': 2})
+        await communicator.disconnect()
+
+
+class AccessCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = create_owner('ana')
+        self.luis = create_owner('luis')
+        self.ana_user = User.objects.create_user('ana', 'x')
+        self.luis_user = User.objects.create_user('luis', 'x')
+        self.device = Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        self.pet = create_pet(self.ana, self.device, 'CHIP1')
+
+    def test_owner_change_is_visible_immediately(self):
+        self.assertTrue(can_access_device(self.ana_user, 'KPCL0001'))
+        self.assertEqual(accessible_device_ids(self.luis_user), frozenset())
+
+        self.pet.owner = self.luis
+        self.pet.save()
+        with self.assertNumQueries(4):  # propietario y mascotas de cada usuario
+            self.assertFalse(can_access_device(self.ana_user, 'KPCL0001'))
+            self.assertEqual(accessible_device_ids(self.luis_user), {'KPCL0001'})
+        with self.assertNumQueries(0):
+            self.assertTrue(can_access_device(self.luis_user, 'KPCL0001'))
+
+    def test_device_change_is_visible_immediately(self):
+        self.assertEqual(accessible_device_ids(self.ana_user), {'KPCL0001'})
+        Device.objects.create(device_id='KPCL0002', name='Collar', type='KPCL')
+        self.pet.kitty_paw_device_id = 'KPCL0002'
+        self.pet.save()
+        self.assertEqual(accessible_device_ids(self.ana_user), {'KPCL0002'})
+        self.assertFalse(can_access_device(self.ana_user, 'KPCL0001'))
+
+    def test_owner_deletion_bumps_generation(self):
+        accessible_device_ids(self.luis_user)
+        generation = cache.get(GENERATION_KEY)
+        self.luis.delete()
+        self.assertNotEqual(cache.get(GENERATION_KEY), generation)
+
+
+class MqttClientIngestTests(TestCase):
+    def setUp(self):
+        with self.settings(MQTT_WILDCARD_TOPIC='+/pub'):
+            self.mqtt = MqttClient()
+        self.mqtt.client = mock.Mock()
+        self.mqtt.writer = mock.Mock()
+        self.mqtt.broadcast_to_clients = mock.Mock()
+
+    def message(self, topic, payload):
+        return mock.Mock(topic=topic, payload=payload)
+
+    def item(self, device_id):
+        return IngestItem(device_id, 'online', None, timezone.now(), [('temperature', 21.5, '°C')])
+
+    def test_wildcard_allow_list(self):
+        Device.objects.create(device_id='KPCL0001', name='Collar', type='KPCL')
+        self.mqtt.devices.refresh_known(force=True)
+
+        with self.assertNumQueries(0):
+            self.mqtt.on_message(None, None, self.message('KPCL0009/pub', b'{"temperature": 21.5}'))
+            self.mqtt.on_message(None, None, self.message('KPCL0001/pub', b'{"temperature": 21.5}'))
+        [[item], _] = self.mqtt.writer.submit.call_args
+        self.assertEqual(item.device_id, 'KPCL0001')
+        self.assertEqual(self.mqtt.broadcast_to_clients.call_count, 1)
+
+    def test_disallowed_sample_does_not_drop_the_rest_of_the_packet(self):
+        self.mqtt.devices = mock.Mock(allows=lambda device_id: device_id != 'KPCL0009')
+        decoded = [(self.item('KPCL0009'), 'a'), (self.item('KPCL0001'), 'b'), (self.item('KPCL0002'), 'c')]
+        with mock.patch('kittypaw_app.mqtt_client.decode_message', return_value=decoded):
+            self.mqtt.on_message(None, None, self.message('collares/lote', b''))
+        self.assertEqual([call.args[0].device_id for call in self.mqtt.writer.submit.call_args_list],
+                         ['KPCL0001', 'KPCL0002'])
+
+    def test_subscribes_every_topic_in_one_call(self):
+        MqttTopic.objects.create(topic='KPCL0001/pub')  # ya cubierto por el comodín
+        MqttTopic.objects.create(topic='casa/luz', qos=1)
+        self.mqtt.load_topics()
+        self.mqtt.on_connect(self.mqtt.client, None, {}, 0)
+        self.mqtt.client.subscribe.assert_called_once_with([('+/pub', 0), ('casa/luz', 1)])
+
+
+class SensorDataWriterTests(SimpleTestCase):
+    def writer(self, **options):
+        writer = SensorDataWriter(registry=mock.Mock(), device_state=mock.Mock(), **options)
+        self.batches = []
+        self.flushed = threading.Event()
+
+        def flush(batch):
+            self.batches.append([item.device_id for item in batch])
+            self.flushed.set()
+
+        writer._flush = flush
+        self.addCleanup(writer.stop)
+        return writer
+
+    def item(self, device_id):
+        return IngestItem(device_id, 'online', None, timezone.now(), [('temperature', 21.5, '°C')])
+
+    def test_flushes_when_batch_size_is_reached(self):
+        writer = self.writer(batch_size=3, flush_interval=60)
+        writer.start()
+        for n in range(3):
+            writer.submit(self.item(f'KPCL000{n}'))
+        self.assertTrue(self.flushed.wait(2))
+        self.assertEqual(self.batches, [['KPCL0000', 'KPCL0001', 'KPCL0002']])
+
+    def test_flushes_partial_batch_at_the_deadline(self):
+        writer = self.writer(batch_size=1000, flush_interval=0.05)
+        writer.start()
+        writer.submit(self.item('KPCL0001'))
+        self.assertTrue(self.flushed.wait(2))
+        self.assertEqual(self.batches, [['KPCL0001']])
+
+    def test_stop_drains_the_queue(self):
+        writer = self.writer(batch_size=1000, flush_interval=60)
+        writer.start()
+        for n in range(5):
+            writer.submit(self.item(f'KPCL000{n}'))
+        writer.stop()
+        self.assertEqual(self.batches, [[f'KPCL000{n}' for n in range(5)]])
+        writer.device_state.flush.assert_called()
+        self.assertFalse(writer.stats()['running'])
+
+    def test_full_queue_drops_and_counts(self):
+        writer = self.writer(max_queue=2)
+        results = [writer.submit(self.item('KPCL0001')) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        stats = writer.stats()
+        self.assertEqual((stats['queued'], stats['enqueued'], stats['dropped']), (2, 2, 1))
+
+
+class DeviceRegistryTests(TestCase):
+    def setUp(self):
+        for n in range(3):
+            Device.objects.create(device_id=f'KPCL000{n}', name='Collar', type='KPCL')
+
+    @mock.patch('kittypaw_app.device_cache.time.monotonic', return_value=100.0)
+    def test_unknown_devices_are_remembered_for_the_negative_ttl(self, monotonic):
+        registry = DeviceRegistry(ttl=300, negative_ttl=30)
+        with self.assertNumQueries(1):
+            self.assertIsNone(registry.get('NOEXISTE'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(registry.get('NOEXISTE'))
+        monotonic.return_value = 130.0
+        with self.assertNumQueries(1):
+            self.assertIsNone(registry.get('NOEXISTE'))
+
+    def test_get_many_loads_a_batch_with_one_query(self):
+        registry = DeviceRegistry()
+        device_ids = ['KPCL0000', 'KPCL0001', 'KPCL0002', 'NOEXISTE']
+        with self.assertNumQueries(1):
+            found = registry.get_many(device_ids)
+        self.assertEqual(sorted(found), device_ids[:3])
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(registry.get_many(device_ids)), device_ids[:3])
+        self.assertEqual((registry.hits, registry.misses), (4, 4))
+
+    def test_device_and_pet_signals_invalidate_the_client_cache(self):
+        registry = mqtt_client.devices
+        registry.invalidate()
+        device = Device.objects.get(device_id='KPCL0001')
+
+        registry.get('KPCL0001')
+        device.status = 'online'
+        device.save()
+        self.assertIsNone(registry.peek('KPCL0001'))
+        self.assertEqual(registry.get('KPCL0001').status, 'online')
+
+        # El propietario del collar forma parte de la entrada
+        owner = create_owner('ana')
+        pet = create_pet(owner, device, 'CHIP1')
+        self.assertIsNone(registry.peek('KPCL0001'))
+        self.assertEqual(registry.get('KPCL0001').owner_id, owner.pk)
+
+        pet.delete()
+        self.assertIsNone(registry.peek('KPCL0001'))
+        registry.get('KPCL0001')
+        device.delete()
+        self.assertIsNone(registry.peek('KPCL0001'))
+        self.assertIsNone(registry.get('KPCL0001'))
+
+
+class FakePahoClient:
+    """
+    Cliente paho simulado: su socket es un extremo de un socketpair y avisa
+    de la apertura y el cierre por los callbacks de socket, como paho
+    """
+    def __init__(self, *args, **kwargs):
+        self.sock, self.peer = socket.socketpair()
+        self.reads = 0
+        self.connected_to = None
+
+    def connect(self, host, port, keepalive):
+        self.connected_to = (host, port, keepalive)
+        self.on_socket_open(self, None, self.sock)
+
+    def loop_read(self):
+        self.sock.recv(1)
+        self.reads += 1
+
+    def loop_misc(self):
+        return 0
+
+    def is_connected(self):
+        return self.connected_to is not None
+
+    def disconnect(self):
+        self.on_socket_close(self, None, self.sock)
+        self.connected_to = None
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class AsyncMqttClientTests(SimpleTestCase):
+    async def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('la condición no se cumplió')
+
+    def engine(self):
+        engine = AsyncMqttClient()
+        engine.writer = mock.Mock()
+        engine.offline_detector = mock.Mock()
+        return engine
+
+    async def test_start_and_stop_register_the_socket_on_the_loop(self):
+        engine = self.engine()
+        params = {'broker_url': 'mqtt://localhost:1883', 'client_id': 'kittypaw_test'}
+        with mock.patch('kittypaw_app.mqtt_client.mqtt.Client', FakePahoClient), \
+                mock.patch.object(engine, 'load_topics'), \
+                mock.patch.object(engine, 'get_connection_params', return_value=params), \
+                mock.patch.object(engine, 'record_connection') as record:
+            await engine.start()
+            await engine.start()  # idempotente
+            paho = engine.client
+            self.addCleanup(paho.close)
+
+            self.assertEqual(paho.connected_to, ('localhost', 1883, 60))
+            record.assert_called_once_with('localhost:1883', 'kittypaw_test', None, None)
+            engine.writer.start.assert_called_once()
+            engine.offline_detector.start.assert_called_once()
+
+            # El socket se lee desde el event loop, sin hilo de red de paho
+            paho.peer.send(b'x')
+            await self.wait_for(lambda: paho.reads == 1)
+
+            fanout = engine._fanout_task
+            await engine.stop()
+            self.assertIsNone(engine.client)
+            self.assertFalse(engine._started)
+            engine.writer.stop.assert_called_once()
+            await asyncio.sleep(0)
+            self.assertTrue(fanout.cancelled())
+
+            # El socket ya no está registrado en el loop
+            paho.peer.send(b'x')
+            await asyncio.sleep(0.05)
+            self.assertEqual(paho.reads, 1)
+
+    async def test_fanout_sends_queued_events_from_the_loop(self):
+        engine = self.engine()
+        entries = {}
+        engine.devices = mock.Mock()
+        engine.devices.peek.side_effect = entries.get
+        engine.devices.get.side_effect = lambda device_id: entries.setdefault(device_id, mock.Mock(owner_id=7))
+
+        loop_thread = threading.get_ident()
+        sent = []
+
+        async def group_send(group, message):
+            sent.append((group, message['type'], threading.get_ident()))
+
+        engine.loop = asyncio.get_running_loop()
+        engine._loop_thread = loop_thread
+        engine._events = asyncio.Queue()
+        with mock.patch('channels.layers.get_channel_layer', return_value=mock.Mock(group_send=group_send)):
+            task = engine.loop.create_task(engine._fanout())
+            # Los eventos llegan desde el hilo escritor
+            thread = threading.Thread(target=engine.broadcast_to_clients, args=(
+                {'type': 'deviceStatus', 'deviceId': 'KPCL0001', 'status': 'online'},
+            ))
+            thread.start()
+            thread.join()
+            await self.wait_for(lambda: len(sent) == 3)
+            task.cancel()
+
+        self.assertEqual(sent, [
+            (device_group('KPCL0001'), 'send_device_status', loop_thread),
+            (ALL_DEVICES_GROUP, 'send_device_status', loop_thread),
+            (owner_group(7), 'send_device_status', loop_thread),
+        ])
+        engine.devices.get.assert_called_once_with('KPCL0001')
@@ -18,6 +18,7 @@ urlpatterns = [
     
     # Rutas para datos de sensores
     path('sensor-data/<str:device_id>/', views.SensorDataView.as_view(), name='sensor-data'),
+    path('sensor-data/<str:device_id>/export/', views.SensorDataExportView.as_view(), name='sensor-data-export'),
     path('latest-readings/', views.LatestReadingsView.as_view(), name='latest-readings'),
     
     # Rutas para MQTT
@@ -3,29 +3,47 @@ from django.utils import timezone
 from django.conf import settings
 from django.db.models import Count
 from django.contrib.auth import login, logout, authenticate
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_protect
 
 from rest_framework import viewsets, status, permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from .models import User, Device, SensorData, MqttConnection, PetOwner, Pet
+from .models import User, Device, SensorData, LatestSensorReading, MqttConnection, PetOwner, Pet
 from .serializers import (
     UserSerializer, LoginSerializer, DeviceSerializer, SensorDataSerializer,
     MqttConnectionSerializer, PetOwnerSerializer, PetSerializer,
     SystemMetricsSerializer, SystemInfoSerializer, SensorReadingSerializer
 )
 from .mqtt_client import mqtt_client
+from .access import accessible_device_ids, accessible_devices, can_access_device, can_access_pet, is_admin, owner_id_for_user
+from .pagination import IdCursorPagination, SensorDataCursorPagination
+from .renderers import CSVRenderer, NDJSONRenderer
+from .export import export_stream
+from .metrics import system_metrics
+from .aggregation import BUCKETS, bucketed_series, parse_aggregates, parse_time_range
 
-import json
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+def get_accessible_device(user, device_id):
+    """
+    Dispositivo pedido si el usuario puede verlo; 404 en caso contrario para
+    no revelar qué collares existen
+    """
+    if not can_access_device(user, device_id):
+        raise Http404
+    return get_object_or_404(Device, device_id=device_id)
+
 # Authentication views
 class LoginView(APIView):
     permission_classes = [AllowAny]
@@ -63,6 +81,11 @@ class CurrentUserView(APIView):
 class DeviceViewSet(viewsets.ModelViewSet):
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
+    pagination_class = IdCursorPagination
+    
+    def get_queryset(self):
+        # Un usuario no administrador solo ve los collares de sus mascotas
+        return accessible_devices(self.request.user)
     
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
@@ -71,60 +94,133 @@ class DeviceViewSet(viewsets.ModelViewSet):
         if response.status_code == status.HTTP_201_CREATED:
             device_id = response.data.get('device_id')
             if device_id:
-                mqtt_client.add_topic(device_id)
+                mqtt_client.add_topic(device_id, persist=True)
         
         return response
 
 # SensorData views
 class SensorDataView(APIView):
+    pagination_class = SensorDataCursorPagination
+    
     def get(self, request, device_id):
-        limit = int(request.query_params.get('limit', 100))
         sensor_type = request.query_params.get('type')
         
-        device = get_object_or_404(Device, device_id=device_id)
+        device = get_accessible_device(request.user, device_id)
         
+        # Con ?bucket= se devuelve el historial agregado en lugar de filas crudas
+        if request.query_params.get('bucket'):
+            return self.get_aggregated(request, device, sensor_type)
+        
+        data = SensorData.objects.filter(device=device)
         if sensor_type:
-            data = SensorData.objects.filter(device=device, sensor_type=sensor_type)[:limit]
-        else:
-            data = SensorData.objects.filter(device=device)[:limit]
+            data = data.filter(sensor_type=sensor_type)
         
-        serializer = SensorDataSerializer(data, many=True)
-        return Response(serializer.data)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(data, request, view=self)
+        serializer = SensorDataSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    def get_aggregated(self, request, device, sensor_type):
+        bucket = request.query_params.get('bucket')
+        if bucket not in BUCKETS:
+            return Response(
+                {'message': f"Bucket no soportado: {bucket}. Opciones: {', '.join(BUCKETS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            aggregates = parse_aggregates(request.query_params.get('agg'))
+            start, end = parse_time_range(request.query_params)
+            series = bucketed_series(device, sensor_type, bucket, aggregates, start, end)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'deviceId': device.device_id,
+            'bucket': bucket,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'series': series
+        })
+
+class SensorDataExportView(APIView):
+    """
+    Exporta el historial de un dispositivo como CSV o NDJSON en streaming
+    """
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+    
+    def get(self, request, device_id):
+        device = get_accessible_device(request.user, device_id)
+        
+        try:
+            start, end = parse_time_range(request.query_params, default_span=timezone.timedelta(days=30))
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = SensorData.objects.filter(device=device, timestamp__gte=start, timestamp__lt=end)
+        sensor_type = request.query_params.get('type')
+        if sensor_type:
+            queryset = queryset.filter(sensor_type=sensor_type)
+        
+        export_format = request.accepted_renderer.format
+        response = StreamingHttpResponse(
+            # Solo ASGIRequest tiene `scope`; la Request de DRF delega el atributo
+            export_stream(queryset, export_format, asynchronous=hasattr(request, 'scope')),
+            content_type=request.accepted_renderer.media_type
+        )
+        filename = f"{device.device_id}_{start:%Y%m%d}_{end:%Y%m%d}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Los errores (400, 403, 404...) se devuelven como JSON y no como text/csv
+        if isinstance(response, Response) and response.status_code >= 400:
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
 
 class LatestReadingsView(APIView):
     def get(self, request):
-        # Obtener la última lectura de cada dispositivo para cada tipo de sensor
-        latest_readings = []
+        # Una sola consulta sobre la proyección de últimas lecturas
+        readings = LatestSensorReading.objects.select_related('device').order_by('device_id', 'sensor_type')
         
-        for device in Device.objects.all():
-            for sensor_type in ['temperature', 'humidity', 'light', 'weight']:
-                try:
-                    reading = SensorData.objects.filter(
-                        device=device,
-                        sensor_type=sensor_type
-                    ).order_by('-timestamp').first()
-                    
-                    if reading:
-                        data = json.loads(reading.data)
-                        latest_readings.append({
-                            'device': device,
-                            'sensor_type': sensor_type,
-                            'value': data.get('value', 0),
-                            'unit': data.get('unit', ''),
-                            'timestamp': reading.timestamp
-                        })
-                except Exception as e:
-                    logger.error(f"Error obteniendo lectura para {device.device_id} - {sensor_type}: {str(e)}")
+        device_ids = accessible_device_ids(request.user)
+        if device_ids is not None:
+            readings = readings.filter(device_id__in=device_ids)
         
-        serializer = SensorReadingSerializer(latest_readings, many=True)
-        return Response(serializer.data)
+        device_id = request.query_params.get('device')
+        if device_id:
+            readings = readings.filter(device_id=device_id)
+        
+        sensor_type = request.query_params.get('type')
+        if sensor_type:
+            readings = readings.filter(sensor_type=sensor_type)
+        
+        readings = list(readings)
+        
+        # ETag derivado de cada fila devuelta (collar, tipo y última escritura):
+        # si el conjunto o alguna lectura cambia, cambia la etiqueta
+        digest = hashlib.md5(usedforsecurity=False)
+        for reading in readings:
+            digest.update(f"{reading.device_id}|{reading.sensor_type}|{reading.updated_at.timestamp()}\n".encode())
+        etag = quote_etag(digest.hexdigest())
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        
+        serializer = SensorReadingSerializer(readings, many=True)
+        return Response(serializer.data, headers={'ETag': etag})
 
 # MQTT views
 class MqttStatusView(APIView):
     def get(self, request):
         return Response({
             'connected': mqtt_client.is_connected(),
-            'topics': list(mqtt_client.topics)
+            'topics': list(mqtt_client.topics),
+            'ingestion': mqtt_client.writer.stats(),
+            'deviceCache': mqtt_client.devices.stats(),
+            'deviceState': mqtt_client.device_state.stats(),
+            'trackedDevices': mqtt_client.offline_detector.tracked()
         })
 
 class MqttConnectView(APIView):
@@ -158,27 +254,41 @@ class MqttSubscribeView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        mqtt_client.add_topic(topic)
+        # Solo un administrador añade suscripciones permanentes para todos los workers
+        mqtt_client.add_topic(topic, persist=is_admin(request.user))
         return Response({'message': f'Suscrito al tópico {topic}'})
 
 # Pet & PetOwner views
 class PetOwnerViewSet(viewsets.ModelViewSet):
     queryset = PetOwner.objects.all()
     serializer_class = PetOwnerSerializer
+    pagination_class = IdCursorPagination
+    
+    def get_queryset(self):
+        queryset = PetOwner.objects.all()
+        if not is_admin(self.request.user):
+            queryset = queryset.filter(pk=owner_id_for_user(self.request.user))
+        return queryset
 
 class PetViewSet(viewsets.ModelViewSet):
     queryset = Pet.objects.all()
     serializer_class = PetSerializer
+    pagination_class = IdCursorPagination
     
     def get_queryset(self):
-        queryset = Pet.objects.all()
-        owner_id = self.request.query_params.get('owner_id')
+        # owner y kitty_paw_device se serializan en cada fila: se traen en la misma consulta
+        queryset = Pet.objects.select_related('owner', 'kitty_paw_device')
+        if not is_admin(self.request.user):
+            queryset = queryset.filter(owner_id=owner_id_for_user(self.request.user))
+        owner_id = self.kwargs.get('owner_id') or self.request.query_params.get('owner_id')
         if owner_id:
             queryset = queryset.filter(owner_id=owner_id)
         return queryset
 
 class PetByDeviceView(APIView):
     def get(self, request, device_id):
+        if not can_access_device(request.user, device_id):
+            raise Http404
         pet = get_object_or_404(Pet, kitty_paw_device__device_id=device_id)
         serializer = PetSerializer(pet)
         return Response(serializer.data)
@@ -186,21 +296,11 @@ class PetByDeviceView(APIView):
 # System information views
 class SystemMetricsView(APIView):
     def get(self, request):
-        active_devices = Device.objects.filter(status='online').count()
-        
-        # Contar los sensores activos (los que han enviado datos en la última hora)
-        one_hour_ago = timezone.now() - timezone.timedelta(hours=1)
-        active_sensors = SensorData.objects.filter(timestamp__gte=one_hour_ago).values('device', 'sensor_type').distinct().count()
-        
-        metrics = {
-            'activeDevices': active_devices,
-            'activeSensors': active_sensors,
-            'alerts': 0,  # No hay sistema de alertas implementado aún
-            'lastUpdate': timezone.now().isoformat()
-        }
-        
-        serializer = SystemMetricsSerializer(metrics)
-        return Response(serializer.data)
+        # Compartidas entre usuarios y recalculadas en segundo plano (ver metrics.py)
+        serializer = SystemMetricsSerializer(system_metrics.get())
+        response = Response(serializer.data)
+        patch_cache_control(response, private=True, max_age=int(system_metrics.interval))
+        return response
 
 class SystemInfoView(APIView):
     def get(self, request):
@@ -211,31 +311,18 @@ class SystemInfoView(APIView):
         }
         
         serializer = SystemInfoSerializer(info)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        patch_cache_control(response, private=True, max_age=settings.SYSTEM_INFO_CACHE_SECONDS)
+        return response
 
 # Vistas de plantillas Django
 @login_required(login_url='/login/')
 def index_view(request):
     """Vista principal del dashboard"""
-    # Obtener datos para el contexto
-    active_devices = Device.objects.filter(status='online').count()
-    total_devices = Device.objects.count()
-    
-    # Si el usuario no es admin, filtrar dispositivos por propietario
-    if request.user.role != 'admin':
-        # Buscar el propietario asociado con este usuario (si existe)
-        try:
-            owner = PetOwner.objects.get(username=request.user.username)
-            # Obtener las mascotas del propietario
-            pets = Pet.objects.filter(owner=owner)
-            # Obtener los dispositivos asociados a estas mascotas
-            device_ids = [pet.kitty_paw_device_id for pet in pets if pet.kitty_paw_device_id]
-            active_devices = Device.objects.filter(device_id__in=device_ids, status='online').count()
-            total_devices = Device.objects.filter(device_id__in=device_ids).count()
-        except PetOwner.DoesNotExist:
-            # El usuario no está asociado a ningún propietario
-            active_devices = 0
-            total_devices = 0
+    # Si el usuario no es admin, solo cuentan los collares de sus mascotas
+    devices = accessible_devices(request.user)
+    active_devices = devices.filter(status='online').count()
+    total_devices = devices.count()
     
     # Contexto para la plantilla
     context = {
@@ -256,16 +343,8 @@ def device_detail_view(request, device_id):
     device = get_object_or_404(Device, device_id=device_id)
     
     # Verificar si el usuario tiene acceso a este dispositivo
-    if request.user.role != 'admin':
-        try:
-            owner = PetOwner.objects.get(username=request.user.username)
-            pet = Pet.objects.filter(owner=owner, kitty_paw_device=device).first()
-            if not pet:
-                # El usuario no tiene acceso a este dispositivo
-                return redirect('devices')
-        except PetOwner.DoesNotExist:
-            # El usuario no está asociado a ningún propietario
-            return redirect('devices')
+    if not can_access_device(request.user, device.device_id):
+        return redirect('devices')
     
     context = {
         'device': device,
@@ -284,15 +363,8 @@ def pet_detail_view(request, pet_id):
     pet = get_object_or_404(Pet, id=pet_id)
     
     # Verificar si el usuario tiene acceso a esta mascota
-    if request.user.role != 'admin':
-        try:
-            owner = PetOwner.objects.get(username=request.user.username)
-            if pet.owner != owner:
-                # El usuario no tiene acceso a esta mascota
-                return redirect('pets')
-        except PetOwner.DoesNotExist:
-            # El usuario no está asociado a ningún propietario
-            return redirect('pets')
+    if not can_access_pet(request.user, pet.id):
+        return redirect('pets')
     
     context = {
         'pet': pet,
@@ -9,17 +9,22 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import kittypaw_app.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kittypaw_project.settings')
 
-application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+# Inicializa Django antes de importar código que usa los modelos
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import kittypaw_app.routing  # noqa: E402
+from kittypaw_app.lifespan import MqttEngineMiddleware  # noqa: E402
+
+application = MqttEngineMiddleware(ProtocolTypeRouter({
+    'http': django_asgi_app,
     'websocket': AuthMiddlewareStack(
         URLRouter(
             kittypaw_app.routing.websocket_urlpatterns
         )
     ),
-})
+}))
@@ -0,0 +1,61 @@
+"""
+Arranque de Daphne con compresión permessage-deflate en los WebSockets.
+
+Daphne no expone la opción en su línea de comandos; este módulo acepta los
+mismos argumentos que `daphne` y habilita la extensión en la fábrica de
+WebSockets de autobahn antes de aceptar conexiones:
+
+    python -m kittypaw_project.server -b 0.0.0.0 -p 5000 kittypaw_project.asgi:application
+
+Con uvicorn la extensión viene activada por defecto (`--ws-per-message-deflate`).
+
+Además arranca el motor MQTT en cuanto el reactor está en marcha, sin esperar
+a la primera petición (Daphne no envía eventos lifespan), y lo detiene antes
+de apagarse.
+"""
+import asyncio
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+from twisted.internet import defer, reactor
+from kittypaw_app.lifespan import MqttEngineMiddleware
+
+
+def accept_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+class CompressedServer(Server):
+    def run(self):
+        ready_callable = self.ready_callable
+
+        def ready():
+            # La fábrica se crea dentro de Server.run(); aún no hay conexiones
+            self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+            if isinstance(self.application, MqttEngineMiddleware):
+                # Dentro del event loop: ensure_started crea una tarea asyncio
+                reactor.callLater(0, self.start_engine)
+            if ready_callable:
+                ready_callable()
+
+        self.ready_callable = ready
+        super().run()
+
+    def start_engine(self):
+        engine = self.application
+        engine.ensure_started()
+        reactor.addSystemEventTrigger(
+            'before', 'shutdown',
+            lambda: defer.Deferred.fromFuture(asyncio.ensure_future(engine.stop()))
+        )
+
+
+class CompressedCommandLineInterface(CommandLineInterface):
+    server_class = CompressedServer
+
+
+if __name__ == '__main__':
+    CompressedCommandLineInterface.entrypoint()
@@ -79,12 +79,93 @@ WSGI_APPLICATION = 'kittypaw_project.wsgi.application'
 ASGI_APPLICATION = 'kittypaw_project.asgi.application'
 
 # Channel layers
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# 'memory': un solo proceso; 'redis': producción (REDIS_URL); 'postgres': varios
+# procesos sin servicios extra, con LISTEN/NOTIFY sobre la base de datos.
+# La ingesta corre en `manage.py run_ingest` (MQTT_ENGINE='external') para que
+# cada mensaje MQTT se difunda una sola vez.
+REDIS_URL = os.environ.get('REDIS_URL')
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'redis' if REDIS_URL else 'memory')
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            # Pub/sub: un PUBLISH por grupo en lugar de una escritura por cliente
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [{'address': REDIS_URL}],
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'postgres':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'kittypaw_app.channel_layers.PostgresChannelLayer',
+            'CONFIG': {
+                'channel': 'kittypaw_channels',
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'kittypaw_app.channel_layers.LocalChannelLayer',
+        },
+    }
+
+# Caché: compartida entre procesos con Redis; si no, memoria local por proceso
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Segundos que se reutilizan las mascotas y collares visibles por usuario;
+# los cambios en Pet/PetOwner la invalidan antes (ver kittypaw_app/signals.py)
+ACCESS_CACHE_TIMEOUT = int(os.environ.get('ACCESS_CACHE_TIMEOUT', 300))
+
+# Segundos que se reutilizan las métricas del dashboard antes de recalcularlas
+# en segundo plano; mientras tanto se sirve el último valor
+SYSTEM_METRICS_INTERVAL = float(os.environ.get('SYSTEM_METRICS_INTERVAL', 10))
+
+# Segundos que el navegador puede reutilizar la respuesta de /api/system/info/
+SYSTEM_INFO_CACHE_SECONDS = int(os.environ.get('SYSTEM_INFO_CACHE_SECONDS', 60))
+
+# Ingesta MQTT: las lecturas se guardan en lotes desde un hilo escritor
+MQTT_INGEST_BATCH_SIZE = int(os.environ.get('MQTT_INGEST_BATCH_SIZE', 500))  # filas por lote
+MQTT_INGEST_FLUSH_INTERVAL = float(os.environ.get('MQTT_INGEST_FLUSH_INTERVAL', 0.25))  # segundos
+MQTT_INGEST_QUEUE_SIZE = int(os.environ.get('MQTT_INGEST_QUEUE_SIZE', 10000))  # mensajes en cola
+MQTT_DEVICE_CACHE_TTL = 300  # segundos; respaldo para cambios hechos desde otros procesos
+MQTT_DEVICE_CACHE_NEGATIVE_TTL = 30  # segundos que se recuerda un device_id no registrado
+MQTT_DEVICE_STATE_FLUSH_INTERVAL = float(os.environ.get('MQTT_DEVICE_STATE_FLUSH_INTERVAL', 1.0))  # segundos
+# 'external' (por defecto): el proceso web no se conecta y la ingesta corre en
+# `manage.py run_ingest`, una sola vez aunque haya varios workers web.
+# Conexión dentro del proceso web, solo para desarrollo con un único proceso:
+# 'thread': paho con loop_start(); 'asyncio': cliente dentro del event loop ASGI
+MQTT_ENGINE = os.environ.get('MQTT_ENGINE', 'external')
+# Suscripción comodín; los collares se filtran contra los Device registrados. Vacío = un tópico por dispositivo
+MQTT_WILDCARD_TOPIC = os.environ.get('MQTT_WILDCARD_TOPIC', '+/pub')
+# Frecuencia máxima (Hz) que un cliente WebSocket puede pedir para recibir lecturas agrupadas
+WS_MAX_UPDATE_RATE = float(os.environ.get('WS_MAX_UPDATE_RATE', 10))
+WS_SNAPSHOT_TTL = float(os.environ.get('WS_SNAPSHOT_TTL', 5))  # segundos que se reutiliza la instantánea inicial
+MQTT_BROADCAST_QUEUE_SIZE = int(os.environ.get('MQTT_BROADCAST_QUEUE_SIZE', 10000))  # eventos pendientes hacia WebSockets
+
+# Milisegundos sin datos para considerar un dispositivo offline, por Device.type
+DEVICE_TIMEOUTS_MS = {
+    'default': int(os.environ.get('DEVICE_TIMEOUT_MS', 15000)),
 }
 
+# Particionado mensual de SensorData (manage.py sensordata_partitions)
+SENSOR_DATA_PARTITIONS_AHEAD = int(os.environ.get('SENSOR_DATA_PARTITIONS_AHEAD', 3))  # meses
+SENSOR_DATA_RETENTION_MONTHS = int(os.environ.get('SENSOR_DATA_RETENTION_MONTHS', 12))  # 0 = sin límite
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -23,13 +23,19 @@ def run_server():
     
     # Iniciar el servidor con Daphne
     try:
-        # Daphne permite manejar tanto HTTP como WebSockets
+        # Un único proceso de desarrollo: la ingesta MQTT corre dentro del
+        # servidor salvo que se indique otro MQTT_ENGINE
+        env = dict(os.environ)
+        env.setdefault('MQTT_ENGINE', 'thread')
+        
+        # Daphne permite manejar tanto HTTP como WebSockets; este arranque
+        # añade compresión permessage-deflate a los WebSockets
         server_process = subprocess.Popen([
-            sys.executable, "-m", "daphne", 
+            sys.executable, "-m", "kittypaw_project.server", 
             "-b", "0.0.0.0", 
             "-p", "5000", 
             "kittypaw_project.asgi:application"
-        ])
+        ], env=env)
         
         # Manejador de señales para una salida limpia
         def signal_handler(sig, frame):
@@ -23,6 +23,24 @@ const deviceNames = {
   'KPCL0025': 'Collar de Firulais'
 };
 
+// Lee todas las páginas de un listado paginado por cursor siguiendo `next`
+async function fetchAllPages(url) {
+  const items = [];
+  while (url) {
+    const response = await fetch(url);
+    if (!response.ok) {
+      throw new Error(`Error ${response.status} cargando ${url}`);
+    }
+    const page = await response.json();
+    if (Array.isArray(page)) {
+      return items.concat(page);
+    }
+    items.push(...page.results);
+    url = page.next;
+  }
+  return items;
+}
+
 // Inicialización al cargar la página
 document.addEventListener('DOMContentLoaded', () => {
   // Obtener información del usuario actual
@@ -114,6 +132,12 @@ function connectWebSocket() {
 // Procesa los mensajes recibidos por WebSocket
 function processWebSocketMessage(data) {
   switch (data.type) {
+    case 'snapshot':
+      // Instantánea inicial: dispositivos y últimas lecturas en una sola trama
+      processWebSocketMessage({ type: 'devices', data: data.devices });
+      processWebSocketMessage({ type: 'sensorData', data: data.sensorData });
+      break;
+      
     case 'devices':
       devices = data.data;
       updateDeviceList();
@@ -131,8 +155,8 @@ function processWebSocketMessage(data) {
           
           sensorData[deviceId][sensorType] = sensorGroup.data;
         }
-      } else if (data.data && data.data.device_id) {
-        const deviceId = data.data.device_id;
+      } else if (data.data && (data.data.device_id || data.deviceId)) {
+        const deviceId = data.data.device_id || data.deviceId;
         
         // Actualizar datos del sensor individual
         for (const sensorType of ['temperature', 'humidity', 'light', 'weight']) {
@@ -163,6 +187,31 @@ function processWebSocketMessage(data) {
       updateCharts();
       break;
       
+    case 'sensorBatch':
+      // Lecturas agrupadas por el servidor (última por dispositivo y sensor)
+      for (const reading of data.data) {
+        if (!sensorData[reading.deviceId]) {
+          sensorData[reading.deviceId] = {};
+        }
+        
+        if (!sensorData[reading.deviceId][reading.sensorType]) {
+          sensorData[reading.deviceId][reading.sensorType] = [];
+        }
+        
+        sensorData[reading.deviceId][reading.sensorType].push({
+          value: reading.value,
+          unit: getSensorUnit(reading.sensorType),
+          timestamp: reading.timestamp
+        });
+        
+        if (sensorData[reading.deviceId][reading.sensorType].length > 60) {
+          sensorData[reading.deviceId][reading.sensorType].shift();
+        }
+      }
+      
+      updateCharts();
+      break;
+      
     case 'deviceStatus':
       updateDeviceStatus(data.deviceId, data.status);
       break;
@@ -656,22 +705,21 @@ async function loadInitialData() {
     console.log(`Cargando datos para usuario: ${userId}, rol: ${userRole}`);
     
     // Cargar dispositivos
-    const devicesResponse = await fetch(`/api/devices?userId=${userId}&role=${userRole}`);
-    if (devicesResponse.ok) {
-      devices = await devicesResponse.json();
+    try {
+      devices = await fetchAllPages(`/api/devices?userId=${userId}&role=${userRole}`);
       console.log('Dispositivos autorizados:', devices.map(d => d.device_id || d.deviceId));
       updateDeviceList();
-    } else {
-      console.error('Error al cargar dispositivos:', devicesResponse.status);
+    } catch (error) {
+      console.error('Error al cargar dispositivos:', error);
     }
     
     // Si estamos en la página de mascotas, cargar datos de mascotas
     const petsContainer = document.getElementById('petsList');
     if (petsContainer) {
-      const petsResponse = await fetch(`/api/pets?userId=${userId}&role=${userRole}`);
-      if (petsResponse.ok) {
-        const pets = await petsResponse.json();
-        updatePetsList(pets);
+      try {
+        updatePetsList(await fetchAllPages(`/api/pets?userId=${userId}&role=${userRole}`));
+      } catch (error) {
+        console.error('Error al cargar mascotas:', error);
       }
     }
     
@@ -685,7 +733,8 @@ async function loadInitialData() {
         const sensorDataResponse = await fetch(`/api/sensor-data/${deviceId}?userId=${userId}&role=${userRole}`);
         
         if (sensorDataResponse.ok) {
-          const sensorDataResult = await sensorDataResponse.json();
+          const sensorDataPage = await sensorDataResponse.json();
+          const sensorDataResult = Array.isArray(sensorDataPage) ? sensorDataPage : sensorDataPage.results;
           if (Array.isArray(sensorDataResult)) {
             processSensorData(deviceId, sensorDataResult);
           } else {
@@ -731,7 +780,7 @@ function processSensorData(deviceId, data) {
   for (const reading of data) {
     try {
       // Verificar que la lectura tiene el formato esperado
-      if (!reading || !reading.sensor_type || !reading.data) {
+      if (!reading || !reading.sensor_type || reading.value === null || reading.value === undefined) {
         console.warn(`Lectura inválida para dispositivo ${deviceId}:`, reading);
         continue;
       }
@@ -743,15 +792,15 @@ function processSensorData(deviceId, data) {
       }
       
       // Convertir datos a formato compatible, con validación
-      const value = parseFloat(reading.data.value);
+      const value = parseFloat(reading.value);
       if (isNaN(value)) {
-        console.warn(`Valor no numérico para sensor ${sensorType}:`, reading.data.value);
+        console.warn(`Valor no numérico para sensor ${sensorType}:`, reading.value);
         continue;
       }
       
       sensorData[deviceId][sensorType].push({
         value: value,
-        unit: reading.data.unit || getSensorUnit(sensorType),
+        unit: reading.unit || getSensorUnit(sensorType),
         timestamp: reading.timestamp || new Date().toISOString()
       });
     } catch (error) {